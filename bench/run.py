@@ -0,0 +1,226 @@
+"""
+Benchmark of MTOAuth against the stub api server (bench/server.py).
+
+Every scenario run in its own process so peak memory is measured per
+scenario, the stub server run in another process so its cpu time isn't
+counted.
+
+## Example
+python bench/run.py
+python bench/run.py --scenario threaded --threads 16 --requests 5000 --latency 0.01
+python bench/run.py --scenario stream --stream-items 200000
+
+## Scenarios
+single    sequential user_info calls
+threaded  user_info calls from --threads threads sharing one client
+large     channel_stream with --stream-items items, whole body decoded
+stream    same response consumed item by item with stream_result
+"""
+
+import json
+import optparse
+import os
+import resource
+import socket
+import subprocess
+import sys
+import threading
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from pymtoauth import MTOAuth
+
+SCENARIOS = ("single", "threaded", "large", "stream")
+
+def percentile(values, p):
+    ## values must be sorted
+    if not values:
+        return 0.0
+    index = min(len(values) - 1, int(round(p / 100.0 * (len(values) - 1))))
+    return values[index]
+
+def client(options, pool_size=10):
+    ## coalescing would hide concurrent identical calls
+    mtoauth = MTOAuth("bench-client", "bench-secret", "http://localhost/",
+        "bench-key", pool_size=pool_size, coalesce=False)
+    mtoauth.api_domain = options.url
+    mtoauth.auth_endpoint = options.url
+    return mtoauth
+
+def timed(func, latencies, errors):
+    start = time.time()
+    try:
+        func()
+    except Exception:
+        errors.append(1)
+    latencies.append(time.time() - start)
+
+def run_single(options):
+    mtoauth = client(options)
+    latencies, errors = [], []
+    for i in xrange(options.requests):
+        timed(lambda: mtoauth.user_info(id=i), latencies, errors)
+    return latencies, errors
+
+def run_threaded(options):
+    mtoauth = client(options, pool_size=options.threads)
+    latencies, errors = [], []
+    per_thread = options.requests // options.threads
+
+    def _worker(n):
+        for i in xrange(per_thread):
+            timed(lambda: mtoauth.user_info(id=n * per_thread + i),
+                latencies, errors)
+
+    threads = [threading.Thread(target=_worker, args=(n,))
+        for n in xrange(options.threads)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return latencies, errors
+
+def run_large(options):
+    mtoauth = client(options)
+    latencies, errors = [], []
+
+    def _call():
+        assert len(mtoauth.channel_stream(id=1, limit=options.stream_items)) \
+            == options.stream_items
+
+    for i in xrange(options.stream_requests):
+        timed(_call, latencies, errors)
+    return latencies, errors
+
+def run_stream(options):
+    mtoauth = client(options)
+    latencies, errors = [], []
+
+    def _call():
+        count = 0
+        for item in mtoauth.stream_result("channel_stream", id=1,
+                limit=options.stream_items):
+            count += 1
+        assert count == options.stream_items
+
+    for i in xrange(options.stream_requests):
+        timed(_call, latencies, errors)
+    return latencies, errors
+
+def run_scenario(options):
+    """
+    Run options.scenario in this process, return report dict.
+    """
+    func = globals()["run_" + options.scenario]
+    times = os.times()
+    start = time.time()
+    latencies, errors = func(options)
+    wall = time.time() - start
+    cpu = sum(os.times()[:2]) - sum(times[:2])
+    latencies.sort()
+    return dict(
+        scenario=options.scenario,
+        requests=len(latencies),
+        errors=len(errors),
+        rps=len(latencies) / wall if wall else 0.0,
+        p50=percentile(latencies, 50) * 1000,
+        p90=percentile(latencies, 90) * 1000,
+        p99=percentile(latencies, 99) * 1000,
+        max=(latencies[-1] if latencies else 0.0) * 1000,
+        cpu=cpu,
+        ## kilobytes on linux
+        peak_rss=resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+    )
+
+def start_server(options):
+    port = options.port
+    process = subprocess.Popen([sys.executable,
+        os.path.join(os.path.dirname(os.path.abspath(__file__)), "server.py"),
+        "--port", str(port), "--latency", str(options.latency),
+        "--items", str(options.items), "--item-size", str(options.item_size),
+        "--error-rate", str(options.error_rate)]
+        + (["--gzip"] if options.gzip else []))
+    deadline = time.time() + 10
+    while True:
+        try:
+            socket.create_connection(("127.0.0.1", port), 0.5).close()
+            break
+        except socket.error:
+            if time.time() > deadline or process.poll() is not None:
+                process.kill()
+                raise RuntimeError("Stub server didn't start on port %d" % port)
+            time.sleep(0.05)
+    return process, "http://127.0.0.1:%d" % port
+
+def child_args(options, scenario):
+    args = [sys.executable, os.path.abspath(__file__), "--child",
+        "--scenario", scenario, "--url", options.url]
+    for name in ("requests", "threads", "stream_items", "stream_requests"):
+        args += ["--" + name.replace("_", "-"), str(getattr(options, name))]
+    return args
+
+def print_report(reports):
+    print "%-9s %7s %6s %9s %8s %8s %8s %8s %7s %10s" % ("scenario",
+        "calls", "errors", "req/s", "p50 ms", "p90 ms", "p99 ms", "max ms",
+        "cpu s", "peak KB")
+    for r in reports:
+        print "%-9s %7d %6d %9.1f %8.2f %8.2f %8.2f %8.2f %7.2f %10d" % (
+            r["scenario"], r["requests"], r["errors"], r["rps"], r["p50"],
+            r["p90"], r["p99"], r["max"], r["cpu"], r["peak_rss"])
+
+def option_parser():
+    parser = optparse.OptionParser()
+    parser.add_option("--scenario", default="all",
+        help="one of %s or all" % ", ".join(SCENARIOS))
+    parser.add_option("--requests", type="int", default=2000,
+        help="calls for single and threaded scenario")
+    parser.add_option("--threads", type="int", default=8)
+    parser.add_option("--stream-items", type="int", default=100000,
+        help="result items of large and stream scenario")
+    parser.add_option("--stream-requests", type="int", default=5)
+    parser.add_option("--url", help="use already running stub server")
+    parser.add_option("--port", type="int", default=8765)
+    parser.add_option("--latency", type="float", default=0.0)
+    parser.add_option("--items", type="int", default=20)
+    parser.add_option("--item-size", type="int", default=200)
+    parser.add_option("--error-rate", type="float", default=0.0)
+    parser.add_option("--gzip", action="store_true",
+        help="stub server compress response")
+    parser.add_option("--json", action="store_true",
+        help="print reports as json lines")
+    parser.add_option("--child", action="store_true", help=optparse.SUPPRESS_HELP)
+    return parser
+
+def main():
+    parser = option_parser()
+    options, args = parser.parse_args()
+    if options.scenario != "all" and options.scenario not in SCENARIOS:
+        parser.error("unknown scenario %s" % options.scenario)
+    if options.child:
+        print json.dumps(run_scenario(options))
+        return
+
+    scenarios = SCENARIOS if options.scenario == "all" else [options.scenario]
+    server = None
+    if not options.url:
+        server, options.url = start_server(options)
+    try:
+        reports = []
+        for scenario in scenarios:
+            output = subprocess.check_output(child_args(options, scenario))
+            reports.append(json.loads(output.strip().splitlines()[-1]))
+    finally:
+        if server is not None:
+            server.kill()
+            server.wait()
+
+    if options.json:
+        for report in reports:
+            print json.dumps(report)
+    else:
+        print_report(reports)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,145 @@
+"""
+Stub Mindtalk api server for benchmark, answer every /v1/... path with a
+`result` list and /access_token with a new token.
+
+## Example
+python bench/server.py --port 8765 --latency 0.005 --items 20 --error-rate 0.01 --gzip
+
+`limit` query parameter, when given, override the number of items, e.g
+/v1/channel/stream?id=1&limit=100000 answer 100000 posts.
+"""
+
+import BaseHTTPServer
+import SocketServer
+import gzip
+import json
+import optparse
+import random
+import socket
+import StringIO
+import threading
+import time
+import urlparse
+
+class StubServer(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+
+    daemon_threads = True
+    allow_reuse_address = True
+    ## benchmark open many connections at once, default backlog of 5 make
+    ## the kernel drop SYN and client wait for retransmit
+    request_queue_size = 1024
+
+    def __init__(self, address, latency=0.0, items=20, error_rate=0.0,
+            item_size=200, gzip=False):
+        BaseHTTPServer.HTTPServer.__init__(self, address, StubHandler)
+        self.latency = latency
+        self.items = items
+        self.error_rate = error_rate
+        self.item_size = item_size
+        ## compress response when client accept gzip
+        self.gzip = gzip
+        ## encoded body by (number of items, gzipped)
+        self._bodies = {}
+        self._lock = threading.Lock()
+        self.token_count = 0
+
+    def body(self, items, gzipped=False):
+        body = self._bodies.get((items, gzipped))
+        if body is None and gzipped:
+            buf = StringIO.StringIO()
+            gz = gzip.GzipFile(fileobj=buf, mode="wb", compresslevel=6)
+            gz.write(self.body(items))
+            gz.close()
+            body = self._bodies[(items, gzipped)] = buf.getvalue()
+        elif body is None:
+            item = dict(id=0, user_id=1, user_name="rizkyabdilah",
+                message="x" * self.item_size, created=1340000000, likes=3)
+            result = []
+            for i in xrange(items):
+                item = dict(item, id=i)
+                result.append(item)
+            body = self._bodies[(items, gzipped)] = json.dumps(dict(result=result))
+        return body
+
+    def new_token(self):
+        with self._lock:
+            self.token_count += 1
+            return self.token_count
+
+class StubHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send(self, code, body, content_type="application/json", header=""):
+        ## status line, header and body in a single write, avoid waiting for
+        ## delayed ack between small packets
+        self.wfile.write("HTTP/1.1 %d %s\r\n%s"
+            "Content-Type: %s\r\nContent-Length: %d\r\n\r\n%s" % (code,
+            self.responses[code][0], header, content_type, len(body), body))
+
+    def _handle(self):
+        server = self.server
+        url = urlparse.urlsplit(self.path)
+        if self.command == "POST":
+            length = int(self.headers.get("content-length") or 0)
+            self.rfile.read(length)
+
+        if server.latency:
+            time.sleep(server.latency)
+
+        if url.path.endswith("/access_token"):
+            n = server.new_token()
+            self._send(200, "access_token=at%d&refresh_token=rt%d&expires_in=3600"
+                % (n, n), "text/plain")
+        elif not url.path.startswith("/v1/"):
+            self._send(404, json.dumps(dict(error="not found")))
+        elif server.error_rate and random.random() < server.error_rate:
+            self._send(503, json.dumps(dict(error="unavailable")))
+        else:
+            params = urlparse.parse_qs(url.query)
+            try:
+                items = int(params["limit"][0])
+            except (KeyError, ValueError):
+                items = server.items
+            gzipped = server.gzip \
+                and "gzip" in self.headers.get("accept-encoding", "")
+            self._send(200, server.body(items, gzipped),
+                header="Content-Encoding: gzip\r\n" if gzipped else "")
+
+    def setup(self):
+        BaseHTTPServer.BaseHTTPRequestHandler.setup(self)
+        self.connection.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+
+    do_GET = _handle
+    do_POST = _handle
+
+def option_parser():
+    parser = optparse.OptionParser()
+    parser.add_option("--host", default="127.0.0.1")
+    parser.add_option("--port", type="int", default=8765)
+    parser.add_option("--latency", type="float", default=0.0,
+        help="seconds added to every response")
+    parser.add_option("--items", type="int", default=20,
+        help="result items per response")
+    parser.add_option("--item-size", type="int", default=200,
+        help="bytes of message per item")
+    parser.add_option("--error-rate", type="float", default=0.0,
+        help="fraction of api call answered with 503")
+    parser.add_option("--gzip", action="store_true",
+        help="gzip response when client accept it")
+    return parser
+
+def main():
+    options, args = option_parser().parse_args()
+    server = StubServer((options.host, options.port), options.latency,
+        options.items, options.error_rate, options.item_size, options.gzip)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,356 @@
+"""
+Non-blocking MTOAuth for asyncio (or trollius on python 2).
+
+Every endpoint of AsyncMTOAuth return a future instead of the result,
+requests are driven by a CurlMulti whose sockets and timer are hooked
+into the event loop, so no thread is blocked while waiting the api.
+
+## Example
+mtoauth = AsyncMTOAuth(**config)
+
+@asyncio.coroutine
+def show():
+    info = yield From(mtoauth.user_info(name="rizkyabdilah"))
+    print info
+"""
+
+import collections
+import pycurl
+
+try:
+    import asyncio
+except ImportError:
+    import trollius as asyncio
+
+from mtoauth import MTOAuth, MTApiException
+from retry import CircuitOpenError
+
+class AsyncTransport(object):
+
+    ## retry interval when pool exhausted by other (blocking) user
+    pool_retry_interval = 0.05
+
+    def __init__(self, pool, loop=None):
+        self.pool = pool
+        self.loop = loop or asyncio.get_event_loop()
+        self._multi = pycurl.CurlMulti()
+        self._multi.setopt(pycurl.M_SOCKETFUNCTION, self._socket_callback)
+        self._multi.setopt(pycurl.M_TIMERFUNCTION, self._timer_callback)
+        self._timer = None
+        self._retry = None
+        self._fds = {}
+        self._running = {}
+        self._waiting = collections.deque()
+
+    def execute(self, httpreq):
+        """
+        Start the request, return future that resolved to the httpreq once
+        transfer finished.
+        """
+        future = asyncio.Future(loop=self.loop)
+        self._waiting.append((httpreq, future))
+        self._start_waiting()
+        return future
+
+    def _start_waiting(self):
+        while self._waiting:
+            httpreq, future = self._waiting[0]
+            if future.cancelled():
+                self._waiting.popleft()
+                continue
+
+            curl = None
+            if httpreq.pool is not None:
+                curl = httpreq.pool.acquire(block=False)
+                if curl is None:
+                    break
+            self._waiting.popleft()
+
+            try:
+                httpreq.prepare(curl)
+            except Exception as e:
+                ## handle already given back by prepare
+                future.set_exception(e)
+                continue
+            self._running[id(httpreq.curl)] = (httpreq, future)
+            self._multi.add_handle(httpreq.curl)
+
+        ## nothing of ours running will release a handle, poll the pool
+        if self._waiting and not self._running and self._retry is None:
+            self._retry = self.loop.call_later(self.pool_retry_interval,
+                self._on_retry)
+
+    def _on_retry(self):
+        self._retry = None
+        self._start_waiting()
+
+    def _socket_callback(self, what, fd, multi, socketp):
+        reading, writing = self._fds.pop(fd, (False, False))
+        if reading:
+            self.loop.remove_reader(fd)
+        if writing:
+            self.loop.remove_writer(fd)
+        if what == pycurl.POLL_REMOVE:
+            return
+
+        reading = what in (pycurl.POLL_IN, pycurl.POLL_INOUT)
+        writing = what in (pycurl.POLL_OUT, pycurl.POLL_INOUT)
+        if reading:
+            self.loop.add_reader(fd, self._socket_action, fd, pycurl.CSELECT_IN)
+        if writing:
+            self.loop.add_writer(fd, self._socket_action, fd, pycurl.CSELECT_OUT)
+        self._fds[fd] = (reading, writing)
+
+    def _timer_callback(self, timeout_ms):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        if timeout_ms >= 0:
+            self._timer = self.loop.call_later(timeout_ms / 1000.0,
+                self._on_timeout)
+
+    def _on_timeout(self):
+        self._timer = None
+        self._socket_action(pycurl.SOCKET_TIMEOUT, 0)
+
+    def _socket_action(self, fd, event):
+        while True:
+            ret, num_handles = self._multi.socket_action(fd, event)
+            if ret != pycurl.E_CALL_MULTI_PERFORM:
+                break
+        self._check_done()
+
+    def _check_done(self):
+        while True:
+            num_queued, ok_list, err_list = self._multi.info_read()
+            for curl in ok_list:
+                self._done(curl, None)
+            for curl, errno, errmsg in err_list:
+                httpreq = self._running[id(curl)][0]
+                self._done(curl, httpreq.curl_error(errno, errmsg))
+            if num_queued == 0:
+                break
+        self._start_waiting()
+
+    def _done(self, curl, error):
+        httpreq, future = self._running.pop(id(curl))
+        self._multi.remove_handle(curl)
+        if error is None:
+            httpreq.finish()
+        else:
+            httpreq.close(discard=True)
+
+        if future.cancelled():
+            return
+        if error is None:
+            future.set_result(httpreq)
+        else:
+            future.set_exception(error)
+
+    def close(self):
+        for timer in (self._timer, self._retry):
+            if timer is not None:
+                timer.cancel()
+        for httpreq, future in self._running.values():
+            self._multi.remove_handle(httpreq.curl)
+            httpreq.close(discard=True)
+            future.cancel()
+        for httpreq, future in self._waiting:
+            future.cancel()
+        self._running.clear()
+        self._waiting.clear()
+        for fd, (reading, writing) in self._fds.items():
+            if reading:
+                self.loop.remove_reader(fd)
+            if writing:
+                self.loop.remove_writer(fd)
+        self._fds.clear()
+        self._multi.close()
+
+class AsyncMTOAuth(MTOAuth):
+
+    blocking = False
+
+    def __init__(self, *args, **kwargs):
+        loop = kwargs.pop("loop", None)
+        super(AsyncMTOAuth, self).__init__(*args, **kwargs)
+        self.transport = AsyncTransport(self.pool, loop)
+        ## coalesce key -> future of request in flight
+        self._inflight_futures = {}
+
+    @property
+    def loop(self):
+        return self.transport.loop
+
+    def valid_access_token(self):
+        ## called while building request on the loop thread, expiring token
+        ## is refreshed by _perform in executor instead
+        return self.access_token
+
+    def exchange_code_with_access_token(self, code):
+        """
+        Same as MTOAuth.exchange_code_with_access_token but return future
+        of its result, the exchange is run in executor.
+        """
+        return self.loop.run_in_executor(None,
+            super(AsyncMTOAuth, self).exchange_code_with_access_token, code)
+
+    def stream_result(self, name, **params):
+        ## blocking generator, would stall the loop
+        raise TypeError("stream_result needs blocking MTOAuth")
+
+    def _follow(self, source):
+        ## own future per caller, cancelling one doesn't cancel the others
+        future = asyncio.Future(loop=self.loop)
+
+        def _copy(source):
+            if future.cancelled():
+                return
+            if source.cancelled():
+                future.cancel()
+            elif source.exception() is not None:
+                future.set_exception(source.exception())
+            else:
+                future.set_result(source.result())
+
+        source.add_done_callback(_copy)
+        return future
+
+    def perform_request(self, httpreq, cacheable=False):
+        hit, rv = self._before_request(httpreq, cacheable)
+        if hit:
+            result = asyncio.Future(loop=self.loop)
+            result.set_result(rv)
+            return result
+
+        if not (cacheable and self.coalesce):
+            return self._perform(httpreq, cacheable)
+
+        key = self._coalesce_key(httpreq)
+        source = self._inflight_futures.get(key)
+        if source is None:
+            source = self._inflight_futures[key] = self._perform(httpreq, cacheable)
+            source.add_done_callback(
+                lambda future: self._inflight_futures.pop(key, None))
+        return self._follow(source)
+
+    def _perform(self, httpreq, cacheable):
+        result = asyncio.Future(loop=self.loop)
+
+        def _start(httpreq, attempt):
+            if result.cancelled():
+                return
+            try:
+                self._check_circuit(httpreq)
+            except CircuitOpenError as e:
+                result.set_exception(e)
+                return
+            wait = self._before_send(httpreq)
+            if wait > 0:
+                self.loop.call_later(wait, _send, httpreq, attempt)
+            else:
+                _send(httpreq, attempt)
+
+        def _send(httpreq, attempt):
+            if result.cancelled():
+                return
+            self.transport.execute(httpreq).add_done_callback(
+                lambda future: _done(httpreq, attempt, future))
+
+        def _done(httpreq, attempt, future):
+            if result.cancelled():
+                return
+            if future.cancelled():
+                result.cancel()
+                return
+            error = future.exception()
+            try:
+                delay = self._retry_delay(httpreq, error, attempt)
+            except Exception as e:
+                ## e.g raising after_request hook, caller must not hang
+                result.set_exception(e)
+                return
+            if delay is not None:
+                self.loop.call_later(delay, _start, httpreq.copy(), attempt + 1)
+                return
+            if error is not None:
+                result.set_exception(error)
+                return
+            if self.is_token_expired(httpreq):
+                ## refresh is blocking, run it in executor
+                refresh = self.loop.run_in_executor(None,
+                    self._with_fresh_token, httpreq)
+                refresh.add_done_callback(_refreshed)
+                return
+            try:
+                result.set_result(self._after_request(httpreq, cacheable))
+            except Exception as e:
+                result.set_exception(e)
+
+        def _refreshed(future):
+            if result.cancelled():
+                return
+            if future.exception() is not None:
+                result.set_exception(future.exception())
+                return
+            _start(future.result(), 0)
+
+        def _preempted(httpreq, future):
+            if result.cancelled():
+                return
+            if future.exception() is not None:
+                result.set_exception(future.exception())
+                return
+            httpreq.params = dict(httpreq.params, access_token=future.result())
+            _start(httpreq, 0)
+
+        if httpreq.refreshable and self.token_expiring():
+            ## refresh before sending, blocking like the 401 path
+            refresh = self.loop.run_in_executor(None, self._refresh_token_once,
+                httpreq.params["access_token"])
+            refresh.add_done_callback(lambda future: _preempted(httpreq, future))
+        else:
+            _start(httpreq, 0)
+        return result
+
+    def batch(self, calls, concurrency=None):
+        """
+        Same as MTOAuth.batch but return future of the results list.
+        """
+        concurrency = concurrency or self.pool.maxsize
+        results = [None] * len(calls)
+        done = asyncio.Future(loop=self.loop)
+        state = dict(next=0, running=0)
+
+        def _finish(index, future):
+            state["running"] -= 1
+            if future.cancelled():
+                results[index] = (asyncio.CancelledError(), None)
+            elif future.exception() is not None:
+                results[index] = (future.exception(), None)
+            else:
+                results[index] = (None, future.result())
+            _start()
+
+        def _start():
+            while state["next"] < len(calls) and state["running"] < concurrency:
+                index = state["next"]
+                state["next"] += 1
+                name, params = calls[index]
+                try:
+                    future = getattr(self, name)(**params)
+                except Exception as e:
+                    results[index] = (e, None)
+                    continue
+                state["running"] += 1
+                future.add_done_callback(
+                    lambda future, index=index: _finish(index, future))
+
+            if not state["running"] and not done.done():
+                done.set_result(results)
+
+        _start()
+        return done
+
+    def close(self):
+        self.transport.close()
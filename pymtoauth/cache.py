@@ -0,0 +1,243 @@
+"""
+Response cache for anonymous GET endpoints and conditional GET
+(ETag / Last-Modified) revalidation.
+
+ResponseCache only store raw response body, so every hit is decoded again
+and callers never share (and mutate) the same result object.
+
+## Example
+from pymtoauth.cache import ResponseCache, ConditionalCache
+
+cache = ResponseCache(ttl=60, ttls={"/user/info": 300, "/user/stream": 0})
+mtoauth = MTOAuth(cache=cache, conditional_cache=ConditionalCache(),
+    **config)
+"""
+
+import threading
+import time
+import urllib
+import hashlib
+from collections import OrderedDict
+
+def cache_key(endpoint, params, exclude=()):
+    items = sorted((k, v) for k, v in params.iteritems() if k not in exclude)
+    return "%s?%s" % (endpoint, urllib.urlencode(items))
+
+class CacheBackend(object):
+    """
+    Interface of cache storage used by ResponseCache.
+    """
+
+    def get(self, key):
+        raise NotImplementedError
+
+    def set(self, key, value, ttl):
+        raise NotImplementedError
+
+    def delete(self, key):
+        raise NotImplementedError
+
+    def clear(self):
+        raise NotImplementedError
+
+class MemoryCache(CacheBackend):
+    """
+    In process LRU cache, hold at most maxsize entries and maxbytes of
+    values (see sizeof), None disable a limit.
+    """
+
+    def __init__(self, maxsize=1024, maxbytes=64 * 1024 * 1024):
+        self.maxsize = maxsize
+        self.maxbytes = maxbytes
+        self.evictions = 0
+        ## summed size of values held
+        self.bytes = 0
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def sizeof(self, value):
+        ## str value (response body) is counted, override for other values
+        return len(value) if isinstance(value, basestring) else 0
+
+    def _pop(self, key):
+        ## caller must hold the lock
+        entry = self._data.pop(key, None)
+        if entry is not None:
+            self.bytes -= entry[2]
+
+    def get(self, key):
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                return None
+            if entry[0] < time.time():
+                self._pop(key)
+                return None
+            ## re-insert, mark as most recently used
+            del self._data[key]
+            self._data[key] = entry
+            return entry[1]
+
+    def set(self, key, value, ttl):
+        size = self.sizeof(value)
+        with self._lock:
+            self._pop(key)
+            if self.maxbytes is not None and size > self.maxbytes:
+                ## would evict everything and still not fit
+                self.evictions += 1
+                return
+            self._data[key] = (time.time() + ttl, value, size)
+            self.bytes += size
+            while (self.maxsize is not None and len(self._data) > self.maxsize) \
+                    or (self.maxbytes is not None and self.bytes > self.maxbytes):
+                self._pop(next(iter(self._data)))
+                self.evictions += 1
+
+    def delete(self, key):
+        with self._lock:
+            self._pop(key)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+            self.bytes = 0
+
+    def __len__(self):
+        return len(self._data)
+
+class SharedCache(CacheBackend):
+    """
+    Adapter for memcache like client (python-memcached, pylibmc), shared by
+    every process using the same server.
+    """
+
+    def __init__(self, client, prefix="pymtoauth:"):
+        self.client = client
+        self.prefix = prefix
+
+    def _key(self, key):
+        ## memcache key is limited in length and can't contain space
+        return self.prefix + hashlib.sha1(key).hexdigest()
+
+    def get(self, key):
+        return self.client.get(self._key(key))
+
+    def set(self, key, value, ttl):
+        self.client.set(self._key(key), value, time=int(ttl))
+
+    def delete(self, key):
+        self.client.delete(self._key(key))
+
+    def clear(self):
+        ## can't clear only our keys from shared server
+        pass
+
+class LocalMemcache(object):
+    """
+    Local stand-in of memcache client, for development and testing
+    SharedCache without memcache server.
+    """
+
+    def __init__(self, maxsize=1024, maxbytes=64 * 1024 * 1024):
+        self._cache = MemoryCache(maxsize, maxbytes)
+
+    def get(self, key):
+        return self._cache.get(key)
+
+    def set(self, key, value, time=0):
+        self._cache.set(key, value, time or 365 * 24 * 3600)
+        return True
+
+    def delete(self, key):
+        self._cache.delete(key)
+        return True
+
+class ResponseCache(object):
+
+    def __init__(self, backend=None, ttl=60, ttls=None):
+        self.backend = backend if backend is not None else MemoryCache()
+        self.ttl = ttl
+        ## per endpoint ttl, keyed by endpoint path, 0 disable cache
+        self.ttls = ttls or {}
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+    def key(self, endpoint, params):
+        ## api_key doesn't change anonymous response
+        return cache_key(endpoint, params, exclude=("api_key",))
+
+    def endpoint_ttl(self, endpoint):
+        return self.ttls.get(endpoint, self.ttl)
+
+    def get(self, endpoint, params):
+        if not self.endpoint_ttl(endpoint):
+            return None
+        value = self.backend.get(self.key(endpoint, params))
+        with self._lock:
+            if value is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        return value
+
+    def set(self, endpoint, params, value):
+        ttl = self.endpoint_ttl(endpoint)
+        if ttl:
+            self.backend.set(self.key(endpoint, params), value, ttl)
+
+    def invalidate(self, endpoint, params):
+        self.backend.delete(self.key(endpoint, params))
+
+    def clear(self):
+        self.backend.clear()
+
+    def stats(self):
+        return dict(hits=self.hits, misses=self.misses)
+
+class ConditionalCache(object):
+    """
+    Remember validators (ETag, Last-Modified) and decoded result of GET
+    responses. Next request send If-None-Match / If-Modified-Since and
+    stored result is returned when server answer 304 Not Modified.
+
+    With MemoryCache backend the same result object is returned for every
+    304, don't mutate it.
+    """
+
+    def __init__(self, backend=None, ttl=24 * 3600):
+        self.backend = backend if backend is not None else MemoryCache()
+        self.ttl = ttl
+        self.not_modified = 0
+        self._lock = threading.Lock()
+
+    def key(self, endpoint, params):
+        ## access_token is part of the key, authentic response is per user
+        return cache_key(endpoint, params)
+
+    def get(self, endpoint, params):
+        return self.backend.get(self.key(endpoint, params))
+
+    def request_header(self, entry):
+        header = {}
+        if entry.get("etag"):
+            header["If-None-Match"] = entry["etag"]
+        if entry.get("last_modified"):
+            header["If-Modified-Since"] = entry["last_modified"]
+        return header
+
+    def store(self, endpoint, params, response, result):
+        etag = response.header.get("etag")
+        last_modified = response.header.get("last-modified")
+        if not etag and not last_modified:
+            return
+        ## no raw body, it would double the memory held for 24h
+        entry = dict(etag=etag, last_modified=last_modified, result=result)
+        self.backend.set(self.key(endpoint, params), entry, self.ttl)
+
+    def revalidated(self, endpoint):
+        with self._lock:
+            self.not_modified += 1
+
+    def stats(self):
+        return dict(not_modified=self.not_modified)
@@ -0,0 +1,360 @@
+"""
+Resumable crawler walking users and channels graph from seed ids, every
+item found is written as one json line:
+    {"kind": "user", "id": 1, "rel": "user_supporters", "item": {...}}
+
+State (visited ids, ids waiting to be crawled, output offset) is saved to
+checkpoint file regularly, running the same crawl again resume from there.
+
+## Example
+crawler = Crawler(mtoauth, "graph.jsonl", checkpoint="graph.checkpoint",
+    concurrency=8, max_depth=2)
+print crawler.run([("user", 1), ("channel", 15)])
+
+## Several processes, each crawling its own shard of the id space
+crawl_sharded([("user", 1)], shards=4, output="graph-{shard}.jsonl",
+    checkpoint="graph-{shard}.checkpoint", client=config, max_depth=2)
+"""
+
+import collections
+import json
+import os
+import threading
+import time
+import zlib
+
+from mtoauth import MTApiException, MTOAuth
+
+## kind -> [(endpoint, id parameter, kind of result items or None when
+## items are only written, not crawled)]
+DEFAULT_RULES = {
+    "user": [
+        ("user_supporters", "id", "user"),
+        ("user_supporting", "id", "user"),
+        ("user_channels", "user_id", "channel"),
+    ],
+    "channel": [
+        ("channel_members", "id", "user"),
+        ("channel_stream", "id", None),
+    ],
+}
+
+def shard_of(kind, id, shards):
+    ## stable between processes and runs, unlike hash()
+    return zlib.crc32("%s:%s" % (kind, id)) % shards
+
+class Crawler(object):
+
+    ## key of the id in result items
+    id_key = "id"
+
+    def __init__(self, mtoauth, output, checkpoint=None, concurrency=4,
+            max_depth=None, max_items=None, checkpoint_interval=30.0,
+            rules=None, shard=None):
+        self.mtoauth = mtoauth
+        self.output = output
+        self.checkpoint = checkpoint
+        ## threads calling the api at the same time
+        self.concurrency = concurrency
+        ## seeds are depth 0, None walk the whole graph. An id keep the depth
+        ## it was first found at, which depends on crawl order
+        self.max_depth = max_depth
+        ## items read per endpoint per id
+        self.max_items = max_items
+        ## seconds between checkpoints
+        self.checkpoint_interval = checkpoint_interval
+        self.rules = rules if rules is not None else DEFAULT_RULES
+        ## (index, count), only ids of this shard are crawled, others are
+        ## kept in self.foreign for their own shard
+        self.shard = shard
+
+        self.stats = dict(crawled=0, records=0, errors=0)
+        ## (kind, id) ever queued
+        self._seen = set()
+        self._done = set()
+        ## (kind, id, depth) waiting, being crawled, failed, other shard
+        self._pending = collections.deque()
+        self._active = {}
+        self._failed = {}
+        self.foreign = {}
+        self._cond = threading.Condition()
+        ## one checkpoint written at a time, outside of self._cond
+        self._saving = threading.Lock()
+        self._stop = False
+        self._loaded = False
+        self._out = None
+        self._last_checkpoint = time.time()
+
+    def owns(self, kind, id):
+        return self.shard is None or shard_of(kind, id, self.shard[1]) == self.shard[0]
+
+    def _push(self, kind, id, depth):
+        ## caller must hold the lock
+        key = (kind, id)
+        if key in self._seen:
+            return
+        self._seen.add(key)
+        if self.owns(kind, id):
+            self._pending.append((kind, id, depth))
+        else:
+            self.foreign[key] = (kind, id, depth)
+
+    def _load(self):
+        if not self.checkpoint or not os.path.exists(self.checkpoint):
+            return None
+        with open(self.checkpoint) as f:
+            state = json.load(f)
+        self._done = set(tuple(key) for key in state["done"])
+        self._seen = set(self._done)
+        self.stats.update(state["stats"])
+        ## crawled at checkpoint time: crawl again, failed: retry
+        for kind, id, depth in state["pending"] + state["failed"]:
+            self._seen.add((kind, id))
+            self._pending.append((kind, id, depth))
+        for kind, id, depth in state["foreign"]:
+            self._seen.add((kind, id))
+            self.foreign[(kind, id)] = (kind, id, depth)
+        return state["offset"]
+
+    def _snapshot(self):
+        ## caller must hold the lock, output and state must match. Only
+        ## copied here, the slow json dump is done by _write without the lock
+        self._out.flush()
+        self._last_checkpoint = time.time()
+        return dict(
+            ## tell() of file opened for append is wrong until next write
+            offset=os.fstat(self._out.fileno()).st_size,
+            done=list(self._done),
+            pending=list(self._active.values()) + list(self._pending),
+            failed=list(self._failed.values()),
+            foreign=list(self.foreign.values()),
+            stats=dict(self.stats),
+        )
+
+    def _write(self, state):
+        ## caller must hold self._saving, older snapshot never replace newer
+        tmp = self.checkpoint + ".tmp"
+        with open(tmp, "w") as f:
+            json.dump(state, f)
+        ## atomic, crash never leave half written checkpoint
+        os.rename(tmp, self.checkpoint)
+
+    def _fetch(self, name, param, id):
+        ## iter_* raise MTApiException on error page
+        iterate = getattr(self.mtoauth, "iter_" + name, None)
+        if iterate is not None:
+            return list(iterate(max_items=self.max_items, **{param: id}))
+        endpoint = getattr(self.mtoauth, name)
+        rv, httpreq = self.mtoauth.execute_request(
+            endpoint.build_request(self.mtoauth, **{param: id}),
+            endpoint.cacheable)
+        ## httpreq is None when result came from cache
+        if httpreq is not None and httpreq.response.status_code >= 400:
+            raise MTApiException("Crawling %s %s failed, status %s" % (
+                name, id, httpreq.response.status_code))
+        return rv if isinstance(rv, list) else []
+
+    def _crawl(self, node):
+        """
+        Return (json lines, children) of node.
+        """
+        kind, id, depth = node
+        lines, children = [], []
+        for name, param, child_kind in self.rules.get(kind, ()):
+            for item in self._fetch(name, param, id):
+                lines.append(json.dumps(dict(kind=kind, id=id, rel=name,
+                    item=item)) + "\n")
+                if child_kind is not None and isinstance(item, dict) \
+                        and self.id_key in item:
+                    children.append((child_kind, item[self.id_key]))
+        return lines, children
+
+    def _next(self):
+        with self._cond:
+            while not self._pending:
+                if not self._active or self._stop:
+                    self._cond.notify_all()
+                    return None
+                self._cond.wait()
+            if self._stop:
+                return None
+            node = self._pending.popleft()
+            self._active[node[:2]] = node
+            return node
+
+    def _work(self):
+        while True:
+            node = self._next()
+            if node is None:
+                return
+            key, depth = node[:2], node[2]
+            try:
+                lines, children = self._crawl(node)
+            except Exception:
+                with self._cond:
+                    del self._active[key]
+                    self._failed[key] = node
+                    self.stats["errors"] += 1
+                    self._cond.notify_all()
+                continue
+
+            state = None
+            with self._cond:
+                ## written with its done mark, resumed crawl never
+                ## duplicate or lose lines
+                self._out.write("".join(lines))
+                del self._active[key]
+                self._done.add(key)
+                self.stats["crawled"] += 1
+                self.stats["records"] += len(lines)
+                if self.max_depth is None or depth < self.max_depth:
+                    for kind, id in children:
+                        self._push(kind, id, depth + 1)
+                if self.checkpoint and time.time() - self._last_checkpoint \
+                        >= self.checkpoint_interval and self._saving.acquire(False):
+                    state = self._snapshot()
+                self._cond.notify_all()
+            if state is not None:
+                try:
+                    self._write(state)
+                finally:
+                    self._saving.release()
+
+    def run(self, seeds=()):
+        """
+        Crawl from seeds [(kind, id)] or [(kind, id, depth)] until there
+        is nothing left, return stats. Seeds already crawled in previous run
+        (or previous call) are skipped.
+        """
+        offset = None
+        if not self._loaded:
+            offset = self._load()
+            self._loaded = True
+        for seed in seeds:
+            self._push(seed[0], seed[1], seed[2] if len(seed) > 2 else 0)
+
+        self._stop = False
+        self._out = open(self.output, "ab")
+        if offset is not None:
+            ## drop lines written after the last checkpoint
+            self._out.truncate(offset)
+
+        workers = [threading.Thread(target=self._work)
+            for i in xrange(self.concurrency)]
+        for worker in workers:
+            worker.daemon = True
+            worker.start()
+        try:
+            for worker in workers:
+                ## join with timeout keep main thread interruptible
+                while worker.is_alive():
+                    worker.join(1.0)
+        finally:
+            with self._cond:
+                self._stop = True
+                self._cond.notify_all()
+            for worker in workers:
+                worker.join()
+            with self._saving:
+                with self._cond:
+                    state = self._snapshot() if self.checkpoint else None
+                    self._out.close()
+                    self._out = None
+                if state is not None:
+                    self._write(state)
+        return self.stats
+
+def _shard_worker(index, shards, client, options, inbox, outbox):
+    ## long lived shard process, its Crawler keep visited ids between rounds
+    options = dict(options)
+    output = options.pop("output").format(shard=index)
+    checkpoint = options.pop("checkpoint")
+    if checkpoint:
+        checkpoint = checkpoint.format(shard=index)
+    crawler = Crawler(MTOAuth(**client), output, checkpoint,
+        shard=(index, shards), **options)
+    handed = set()
+    while True:
+        seeds = inbox.get()
+        if seeds is None:
+            return
+        try:
+            stats = crawler.run(seeds)
+        except Exception as e:
+            outbox.put((index, None, None, e))
+            return
+        ## foreign ids found since last round only
+        foreign = [node for key, node in crawler.foreign.iteritems()
+            if key not in handed]
+        handed.update(node[:2] for node in foreign)
+        outbox.put((index, stats, foreign, None))
+
+def crawl_sharded(seeds, shards, output, checkpoint, client, **options):
+    """
+    Crawl with one process per shard of the id space. output and
+    checkpoint are path templates with {shard}, client is MTOAuth config,
+    other options are passed to Crawler. Ids found by a shard that belong
+    to another are handed to it in the next round, until no shard find new
+    ones. Return stats summed over shards.
+    """
+    import multiprocessing
+    import Queue
+
+    options = dict(options, output=output, checkpoint=checkpoint)
+    delivered = set()
+    round_seeds = [[] for i in xrange(shards)]
+    for kind, id in seeds:
+        delivered.add((kind, id))
+        round_seeds[shard_of(kind, id, shards)].append((kind, id, 0))
+
+    outbox = multiprocessing.Queue()
+    inboxes, processes = [], []
+    for index in xrange(shards):
+        inbox = multiprocessing.Queue()
+        process = multiprocessing.Process(target=_shard_worker,
+            args=(index, shards, client, options, inbox, outbox))
+        process.daemon = True
+        process.start()
+        inboxes.append(inbox)
+        processes.append(process)
+
+    ## stats are cumulative in each shard, last round has them all
+    shard_stats = [{} for i in xrange(shards)]
+    try:
+        while any(round_seeds):
+            ## every shard run each round, even without seed, so it still
+            ## resume pending ids of its checkpoint
+            for inbox, seeds in zip(inboxes, round_seeds):
+                inbox.put(seeds)
+            round_seeds = [[] for i in xrange(shards)]
+            waiting = set(xrange(shards))
+            while waiting:
+                try:
+                    index, stats, foreign, error = outbox.get(timeout=1.0)
+                except Queue.Empty:
+                    for index in waiting:
+                        if not processes[index].is_alive():
+                            raise RuntimeError("Shard %d process died, exit "
+                                "code %s" % (index, processes[index].exitcode))
+                    continue
+                if error is not None:
+                    raise error
+                waiting.discard(index)
+                shard_stats[index] = stats
+                for kind, id, depth in foreign:
+                    if (kind, id) not in delivered:
+                        delivered.add((kind, id))
+                        round_seeds[shard_of(kind, id, shards)].append(
+                            (kind, id, depth))
+    finally:
+        for inbox, process in zip(inboxes, processes):
+            if process.is_alive():
+                inbox.put(None)
+        for process in processes:
+            process.join()
+
+    total = dict(crawled=0, records=0, errors=0)
+    for stats in shard_stats:
+        for key, value in stats.iteritems():
+            total[key] += value
+    return total
@@ -0,0 +1,185 @@
+"""
+Per endpoint request metrics: latency histograms from curl timings,
+transferred bytes, status codes, errors, retries and cache hits.
+
+## Example
+metrics = Metrics()
+mtoauth = MTOAuth(metrics=metrics, **config)
+mtoauth.user_info(name="rizkyabdilah")
+print metrics.snapshot()["/user/info"]["latency"]["total"]["count"]
+print metrics.prometheus()
+"""
+
+import bisect
+import threading
+
+## seconds
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+## curl timings, every one is measured from the start of the request
+PHASES = ("namelookup", "connect", "appconnect", "starttransfer", "total")
+
+class Histogram(object):
+
+    __slots__ = ("buckets", "counts", "count", "sum")
+
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = buckets
+        ## last one count values above the biggest bucket
+        self.counts = [0] * (len(buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+
+    def cumulative(self):
+        ## [(upper bound, count of values <= bound)], prometheus style
+        rv, total = [], 0
+        for bound, count in zip(self.buckets + (float("inf"),), self.counts):
+            total += count
+            rv.append((bound, total))
+        return rv
+
+    def snapshot(self):
+        return dict(count=self.count, sum=self.sum, buckets=self.cumulative())
+
+class EndpointStats(object):
+
+    __slots__ = ("requests", "errors", "retries", "cache_hits", "status",
+        "bytes_down", "bytes_decoded", "bytes_up", "latency")
+
+    def __init__(self, buckets):
+        self.requests = 0
+        self.errors = 0
+        self.retries = 0
+        self.cache_hits = 0
+        self.status = {}
+        ## on the wire, compressed when server used content-encoding
+        self.bytes_down = 0
+        self.bytes_decoded = 0
+        self.bytes_up = 0
+        self.latency = dict((phase, Histogram(buckets)) for phase in PHASES)
+
+    def snapshot(self):
+        return dict(requests=self.requests, errors=self.errors,
+            retries=self.retries, cache_hits=self.cache_hits,
+            status=dict(self.status), bytes_down=self.bytes_down,
+            bytes_decoded=self.bytes_decoded, bytes_up=self.bytes_up,
+            latency=dict((phase, histogram.snapshot())
+                for phase, histogram in self.latency.iteritems()))
+
+class Metrics(object):
+    """
+    Thread safe, can be shared by several MTOAuth. Request without
+    endpoint (e.g access_token exchange) are recorded under "other".
+    """
+
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = tuple(buckets)
+        self._endpoints = {}
+        self._lock = threading.Lock()
+
+    def _stats(self, endpoint):
+        ## caller must hold the lock
+        endpoint = endpoint or "other"
+        stats = self._endpoints.get(endpoint)
+        if stats is None:
+            stats = self._endpoints[endpoint] = EndpointStats(self.buckets)
+        return stats
+
+    def record(self, httpreq, error=None, retried=False):
+        """
+        Record one executed attempt of httpreq.
+        """
+        response = httpreq.response
+        with self._lock:
+            stats = self._stats(httpreq.endpoint)
+            stats.requests += 1
+            if retried:
+                stats.retries += 1
+            if error is not None:
+                stats.errors += 1
+                key = "error"
+            else:
+                key = response.status_code
+                if key >= 400:
+                    stats.errors += 1
+                latency = stats.latency
+                latency["namelookup"].observe(response.namelookup_time)
+                latency["connect"].observe(response.connect_time)
+                latency["appconnect"].observe(response.appconnect_time)
+                latency["starttransfer"].observe(response.starttransfer_time)
+                latency["total"].observe(response.total_time)
+                stats.bytes_down += response.size_download
+                stats.bytes_decoded += response.size
+                stats.bytes_up += response.size_upload
+            stats.status[key] = stats.status.get(key, 0) + 1
+
+    def cache_hit(self, endpoint):
+        with self._lock:
+            self._stats(endpoint).cache_hits += 1
+
+    def snapshot(self):
+        """
+        Return {endpoint: {"requests": .., "latency": {phase: ..}, ..}}.
+        """
+        with self._lock:
+            return dict((endpoint, stats.snapshot())
+                for endpoint, stats in self._endpoints.iteritems())
+
+    def reset(self):
+        with self._lock:
+            self._endpoints.clear()
+
+    def prometheus(self, prefix="mtoauth"):
+        """
+        Return snapshot in prometheus text exposition format.
+        """
+        lines = []
+        snapshot = self.snapshot()
+
+        def _counter(name, help, key):
+            lines.append("# HELP %s_%s %s" % (prefix, name, help))
+            lines.append("# TYPE %s_%s counter" % (prefix, name))
+            for endpoint, stats in sorted(snapshot.iteritems()):
+                lines.append('%s_%s{endpoint="%s"} %s' % (
+                    prefix, name, endpoint, stats[key]))
+
+        _counter("requests_total", "Executed requests, retries included.",
+            "requests")
+        _counter("errors_total", "Requests failed with curl error or status >= 400.",
+            "errors")
+        _counter("retries_total", "Requests retried.", "retries")
+        _counter("cache_hits_total", "Calls answered by response cache.",
+            "cache_hits")
+        _counter("response_bytes_total", "Bytes downloaded, as sent on the wire.",
+            "bytes_down")
+        _counter("response_decoded_bytes_total", "Bytes downloaded, after decompression.",
+            "bytes_decoded")
+        _counter("request_bytes_total", "Bytes uploaded.", "bytes_up")
+
+        name = "%s_responses_total" % prefix
+        lines.append("# HELP %s Responses by status code." % name)
+        lines.append("# TYPE %s counter" % name)
+        for endpoint, stats in sorted(snapshot.iteritems()):
+            for status, count in sorted(stats["status"].iteritems()):
+                lines.append('%s{endpoint="%s",status="%s"} %d' % (
+                    name, endpoint, status, count))
+
+        name = "%s_request_duration_seconds" % prefix
+        lines.append("# HELP %s Time from request start until phase end." % name)
+        lines.append("# TYPE %s histogram" % name)
+        for endpoint, stats in sorted(snapshot.iteritems()):
+            for phase in PHASES:
+                histogram = stats["latency"][phase]
+                labels = 'endpoint="%s",phase="%s"' % (endpoint, phase)
+                for bound, count in histogram["buckets"]:
+                    le = "+Inf" if bound == float("inf") else repr(bound)
+                    lines.append('%s_bucket{%s,le="%s"} %d' % (name, labels, le, count))
+                lines.append("%s_sum{%s} %r" % (name, labels, histogram["sum"]))
+                lines.append("%s_count{%s} %d" % (name, labels, histogram["count"]))
+
+        return "\n".join(lines) + "\n"
@@ -5,7 +5,6 @@ http://developer.mindtalk.com
 
 Originally written for MTFeed project.
 Library depedency:
-decorator (http://pypi.python.org/pypi/decorator/)
 pycurl (http://pypi.python.org/pypi/pycurl/)
 
 ## Example Usage: Anonym API
@@ -45,27 +44,110 @@ __version__ = "0.2.0"
 import sys
 import os
 import pycurl
-from decorator import decorator
 import urllib
+import urlparse
 import json
-import cgi
+import time
+import threading
+
+from pool import CurlPool
+from multi import execute_multi, iter_perform
+from stream import ResultStreamParser
+from paginate import paginated
+from retry import RetryPolicy, CircuitOpenError
+from singleflight import SingleFlight
+from cache import cache_key
+from upload import MultipartBody, is_upload
 
 class HttpResponse(object):
-    header = {}
-    body = ""
+    
+    __slots__ = ("header", "status_code", "request_url", "total_time", "size",
+        "namelookup_time", "connect_time", "appconnect_time",
+        "starttransfer_time", "size_download", "size_upload",
+        "_chunks", "_body")
+    
+    def __init__(self):
+        ## own dict per response, headers must not leak between requests
+        self.header = {}
+        self.status_code = None
+        self.request_url = None
+        self.total_time = None
+        self.size = 0
+        ## curl timings in seconds since request start, bytes on the wire
+        ## (compressed), size is the decoded body size
+        self.namelookup_time = None
+        self.connect_time = None
+        self.appconnect_time = None
+        self.starttransfer_time = None
+        self.size_download = 0
+        self.size_upload = 0
+        self._chunks = []
+        self._body = ""
+    
+    def write(self, buf):
+        self._chunks.append(buf)
+        self.size += len(buf)
+    
+    @property
+    def body(self):
+        ## join received chunks only once, avoid quadratic string concat
+        if self._chunks:
+            if self._body:
+                self._chunks.insert(0, self._body)
+            self._body = "".join(self._chunks)
+            self._chunks = []
+        return self._body
+    
+    def clear_body(self):
+        ## release raw body once it's decoded, size is kept
+        self._chunks = []
+        self._body = ""
+
+class ResponseTooLarge(pycurl.error):
+    pass
 
 class HttpReq(object):
     
-    response = None
+    __slots__ = ("url", "method", "params", "header", "pool", "max_size",
+        "connect_timeout", "timeout", "accept_encoding", "endpoint", "conditional",
+        "body_consumer", "refreshable", "upload", "upload_progress",
+        "_uploaded", "paused", "response", "already_prepared", "curl")
+    
     USERAGENT = "Mozilla/5.0 (compatible; HttpReq/0.1; +http://limbotolabs.com/~rizky/httpreq.html)"
     
-    def __init__(self, url, method="GET", params={}, header={}):
+    def __init__(self, url, method="GET", params={}, header={}, pool=None,
+            endpoint=None, max_size=None, connect_timeout=None, timeout=None,
+            accept_encoding=None):
         self.url = url
         self.method = method.upper()
         self.params = params
         self.header = header
+        self.pool = pool
+        ## abort transfer when response body is bigger than max_size bytes
+        self.max_size = max_size
+        ## in seconds, timeout is for the whole transfer
+        self.connect_timeout = connect_timeout
+        self.timeout = timeout
+        ## e.g "gzip, deflate", response is decoded by curl while received
+        self.accept_encoding = accept_encoding
+        ## api path this request made for, e.g /user/info
+        self.endpoint = endpoint
+        ## stored response being revalidated, see ConditionalCache
+        self.conditional = None
+        ## when set, body chunks are passed to it instead of being stored,
+        ## returning pycurl.WRITEFUNC_PAUSE pause the transfer
+        self.body_consumer = None
+        self.paused = False
+        ## access_token param can be replaced by refreshed one and replayed
+        self.refreshable = False
+        ## MultipartBody streamed by curl when POST params have upload value
+        self.upload = None
+        ## fn(httpreq, uploaded bytes, total bytes or None)
+        self.upload_progress = None
+        self._uploaded = 0
         self.response = HttpResponse()
         self.already_prepared = False
+        self.curl = None
         
     def _header_callback(self, buf):
         ## some header response like status code really doesn't have key value
@@ -76,29 +158,66 @@ class HttpReq(object):
             pass
     
     def _body_callback(self, buf):
-        self.response.body += buf
+        if self.max_size is not None and self.response.size + len(buf) > self.max_size:
+            ## returning other than len(buf) make curl abort the transfer
+            self.response.size += len(buf)
+            return 0
+        if self.body_consumer is not None:
+            if self.body_consumer(buf) == pycurl.WRITEFUNC_PAUSE:
+                ## buf not taken, curl deliver it again once unpaused
+                self.paused = True
+                return pycurl.WRITEFUNC_PAUSE
+            self.response.size += len(buf)
+        else:
+            self.response.write(buf)
         
     def _build_get_parameter(self):
         mark = "&" if "?" in self.url else "?"
         return mark + urllib.urlencode(self.params)
     
+    def _progress_callback(self, dltotal, dlnow, ultotal, ulnow):
+        if ulnow != self._uploaded:
+            self._uploaded = ulnow
+            self.upload_progress(self, ulnow, self.upload.size)
+    
     def _build_post_parameter(self):
         postfields = []
         for k, v in self.params.iteritems():
-            if isinstance(v, file):
-                field = (k, (pycurl.FORM_FILE, v.name))
-            else:
-                field = (k, (pycurl.FORM_CONTENTS, str(v)))
-            postfields.append(field)
+            postfields.append((k, (pycurl.FORM_CONTENTS, str(v))))
         return postfields
     
+    def _build_upload(self):
+        if self.upload is None:
+            self.upload = MultipartBody(self.params)
+        else:
+            ## sent before (retry, token replay), read upload values again
+            self.upload = self.upload.replay(self.params)
+            if self.upload is None:
+                raise pycurl.error(pycurl.E_READ_ERROR,
+                    "Upload can't be sent again: %s" % self.url)
+        
+        ## body is read piece by piece by curl, chunked when size unknown
+        self.curl.setopt(pycurl.POST, 1)
+        self.curl.setopt(pycurl.READFUNCTION, self.upload.read)
+        if self.upload.size is not None:
+            self.curl.setopt(pycurl.POSTFIELDSIZE_LARGE, self.upload.size)
+        self.curl.setopt(pycurl.HTTPHEADER,
+            self._build_header() + self.upload.header())
+        if self.upload_progress is not None:
+            self.curl.setopt(pycurl.NOPROGRESS, 0)
+            self.curl.setopt(pycurl.XFERINFOFUNCTION, self._progress_callback)
+    
     def build_parameter(self):
+        ## return url to request, self.url is kept so request can be copied
         if self.method == "GET" and len(self.params):
-            self._build_get_parameter()
-            self.url += self._build_get_parameter()
+            return self.url + self._build_get_parameter()
         elif self.method == "POST":
-            pf = self._build_post_parameter()
-            self.curl.setopt(pycurl.HTTPPOST, pf)
+            if self.upload is not None \
+                    or any(is_upload(v) for v in self.params.itervalues()):
+                self._build_upload()
+            else:
+                self.curl.setopt(pycurl.HTTPPOST, self._build_post_parameter())
+        return self.url
         
     def _build_header(self):
         def _header(k, v):
@@ -109,139 +228,261 @@ class HttpReq(object):
     def build_header(self):
         self.curl.setopt(pycurl.HTTPHEADER, self._build_header())
     
-    def prepare(self):
-        self.curl = pycurl.Curl()
+    def prepare(self, curl=None):
+        ## curl can be given by caller that already hold a pooled handle
+        if curl is not None:
+            self.curl = curl
+        elif self.pool is not None:
+            self.curl = self.pool.acquire()
+        else:
+            self.curl = pycurl.Curl()
+        try:
+            self._setup()
+        except Exception:
+            ## e.g non ascii unicode param, don't leak the pooled handle
+            self.close(discard=True)
+            raise
+        self.already_prepared = True
+    
+    def _setup(self):
+        if self.pool is not None:
+            self.pool.setup(self.curl)
         
         self.build_header()
-        self.build_parameter()
+        url = self.build_parameter()
             
-        self.curl.setopt(pycurl.URL, self.url)
+        self.curl.setopt(pycurl.URL, url)
         self.curl.setopt(pycurl.FOLLOWLOCATION, 1)
         self.curl.setopt(pycurl.MAXREDIRS, 5)
         self.curl.setopt(pycurl.HEADERFUNCTION, self._header_callback)
         self.curl.setopt(pycurl.WRITEFUNCTION, self._body_callback)
         self.curl.setopt(pycurl.USERAGENT, self.USERAGENT)
-        
-        self.already_prepared = True
+        if self.max_size is not None:
+            ## fail early when server tell Content-Length
+            self.curl.setopt(pycurl.MAXFILESIZE, self.max_size)
+        ## timeout with signal is not thread safe
+        self.curl.setopt(pycurl.NOSIGNAL, 1)
+        if self.connect_timeout:
+            self.curl.setopt(pycurl.CONNECTTIMEOUT_MS, int(self.connect_timeout * 1000))
+        if self.timeout:
+            self.curl.setopt(pycurl.TIMEOUT_MS, int(self.timeout * 1000))
+        if self.accept_encoding:
+            self.curl.setopt(pycurl.ENCODING, self.accept_encoding)
+    
+    def copy(self):
+        """
+        Fresh not yet executed request with the same parameter, for retry.
+        """
+        httpreq = HttpReq(self.url, self.method, self.params, self.header,
+            pool=self.pool, endpoint=self.endpoint, max_size=self.max_size,
+            connect_timeout=self.connect_timeout, timeout=self.timeout,
+            accept_encoding=self.accept_encoding)
+        httpreq.conditional = self.conditional
+        httpreq.body_consumer = self.body_consumer
+        httpreq.refreshable = self.refreshable
+        httpreq.upload = self.upload
+        httpreq.upload_progress = self.upload_progress
+        return httpreq
+    
+    def can_replay(self):
+        ## streamed upload may not be readable a second time
+        return self.upload is None or self.upload.can_replay()
+    
+    def host(self):
+        return urlparse.urlsplit(self.url).netloc
         
     def execute(self):
         if not self.already_prepared:
             self.prepare()
-        self.curl.perform()
+        try:
+            self.curl.perform()
+        except pycurl.error as e:
+            self.close(discard=True)
+            raise self.curl_error(*e.args)
         
-        _effective_url = self.curl.getinfo(pycurl.EFFECTIVE_URL)
-        _status_code = self.curl.getinfo(pycurl.HTTP_CODE)
-        setattr(self.response, "request_url", _effective_url)
-        setattr(self.response, "status_code", int(_status_code))
+        return self.finish()
+    
+    def curl_error(self, errno, errmsg=""):
+        if self.max_size is not None and (errno == pycurl.E_FILESIZE_EXCEEDED
+                or self.response.size > self.max_size):
+            return ResponseTooLarge(errno,
+                "Response larger than %d bytes: %s" % (self.max_size, self.url))
+        return pycurl.error(errno, errmsg)
+    
+    def finish(self):
+        ## collect transfer info once curl done with the request
+        response, getinfo = self.response, self.curl.getinfo
+        response.request_url = getinfo(pycurl.EFFECTIVE_URL)
+        response.status_code = int(getinfo(pycurl.HTTP_CODE))
+        response.total_time = getinfo(pycurl.TOTAL_TIME)
+        response.namelookup_time = getinfo(pycurl.NAMELOOKUP_TIME)
+        response.connect_time = getinfo(pycurl.CONNECT_TIME)
+        response.appconnect_time = getinfo(pycurl.APPCONNECT_TIME)
+        response.starttransfer_time = getinfo(pycurl.STARTTRANSFER_TIME)
+        response.size_download = int(getinfo(pycurl.SIZE_DOWNLOAD))
+        response.size_upload = int(getinfo(pycurl.SIZE_UPLOAD))
         
-        self.curl.close()
+        self.close()
         
         return self.response
     
+    def close(self, discard=False):
+        ## give pooled handle back instead of closing it, keep connection alive
+        if self.pool is not None:
+            self.pool.release(self.curl, discard=discard)
+        else:
+            self.curl.close()
+        self.curl = None
+    
 class MTApiException(Exception): pass
     
-def intersect(list1, list2):
-    return list(set(list1) & set(list2))
+ANONYM, AUTHENTIC, VERIFIED = "anonym", "authentic", "verified"
+
+class Endpoint(object):
+    """
+    Api endpoint description, compiled once when MTOAuth class is created.
+    Every endpoint is listed in MTOAuth.endpoints, e.g:
+        print MTOAuth.endpoints["user_info"].as_dict()
+    """
+    
+    __slots__ = ("name", "path", "method", "auth", "required_params",
+        "wiki_path", "cacheable", "_required", "_one_of", "_url")
+    
+    def __init__(self, path, method="GET", auth=ANONYM, required_params=(),
+            wiki_path=None):
+        self.name = None
+        self.path = path
+        self.method = method.upper()
+        self.auth = auth
+        self.required_params = tuple(required_params)
+        self.wiki_path = wiki_path
+        ## only anonymous read is safe to be shared between callers
+        self.cacheable = auth == ANONYM and self.method == "GET"
+        ## param that must be given, and groups of which one must be given
+        self._required = frozenset(p for p in required_params
+            if not isinstance(p, tuple))
+        self._one_of = tuple(frozenset(p) for p in required_params
+            if isinstance(p, tuple))
+        ## (api_domain, api_prefix, full url) of the last call
+        self._url = (None, None, None)
+    
+    def __repr__(self):
+        return "<Endpoint %s %s %s>" % (self.auth, self.method, self.path)
+    
+    def as_dict(self):
+        return dict(name=self.name, path=self.path, method=self.method,
+            auth=self.auth, required_params=list(self.required_params),
+            wiki_path=self.wiki_path)
     
-def check_required_params(path, required_params, **opts):
-    def _wrapper(func, mtapi, *args, **kwargs):
-        required_param_undefined = False
-        all_params_key = kwargs.keys()
-        for param in required_params:
+    def check(self, params):
+        for param in self._required:
+            if param not in params:
+                return self._missing(params)
+        for one_of in self._one_of:
+            if one_of.isdisjoint(params):
+                return self._missing(params)
+    
+    def _missing(self, params):
+        ## report first missing param in declared order
+        for param in self.required_params:
             if isinstance(param, tuple):
-                if not len(intersect(all_params_key, param)):
-                    required_param_undefined = True
-                    param = ", ".join(param[0: len(param) - 1]) + " or " + param[len(param) - 1]
+                if not any(p in params for p in param):
+                    param = ", ".join(param[:-1]) + " or " + param[-1]
                     break
-            elif param not in all_params_key:
-                required_param_undefined = True
+            elif param not in params:
                 break
-            
-        if required_param_undefined:
-            msg = "Error during request %s\nRequiring parameter: %s" % (
-                path, param
-            )
-            if opts.get("wiki_path"):
-                msg += "\nSee wiki %s" % MTOauth.wiki_url(opts.get("wiki_path"))
-            raise MTApiException(msg)
-                
-        return func(mtapi, *args, **kwargs)
-        
-    return decorator(_wrapper)
-
-def anonym_method(path, method="GET", required_params=[], **kwargs):
+        msg = "Error during request %s\nRequiring parameter: %s" % (
+            self.path, param)
+        if self.wiki_path:
+            msg += "\nSee wiki %s" % MTOAuth.wiki_url(self.wiki_path)
+        raise MTApiException(msg)
     
-    @check_required_params(path, required_params, **kwargs)
-    def _call(mtoauth, *args, **kwargs):
-        params = kwargs.copy()
-        params.update(mtoauth.default_params())
-        params["api_key"] = mtoauth.api_key
-        
-        url = mtoauth.api_url(path)
-        httpreq = HttpReq(url, method, params)
-        httpreq.execute()
-        
-        ## store last request state
-        mtoauth.last_request = httpreq
-        
-        rv = json.loads(httpreq.response.body)
-        return rv.get("result") or httpreq.response.body
-        
-    return _call
-
-def authentic_method(path, method="GET", required_params=[], **kwargs):
+    def url(self, mtoauth):
+        domain, prefix, url = self._url
+        if domain is not mtoauth.api_domain or prefix is not mtoauth.api_prefix:
+            url = mtoauth.api_url(self.path)
+            self._url = (mtoauth.api_domain, mtoauth.api_prefix, url)
+        return url
     
-    @check_required_params(path, required_params, **kwargs)
-    def _call(mtoauth, *args, **kwargs):
+    def build_request(self, mtoauth, **kwargs):
+        """
+        Return HttpReq for this endpoint called with kwargs.
+        """
+        self.check(kwargs)
         params = kwargs.copy()
         params.update(mtoauth.default_params())
         
-        _access_token = kwargs.get("access_token") or mtoauth.access_token
-        if _access_token is not None:
-            params["access_token"] = _access_token
+        refreshable = False
+        if self.auth == ANONYM:
+            params["api_key"] = mtoauth.api_key
         else:
-            raise MTApiException("Authentic method need an access_token")
-        
-        
-        url = mtoauth.api_url(path)
-        httpreq = HttpReq(url, method, params)
-        httpreq.execute()
-        
-        ## store last request state
-        mtoauth.last_request = httpreq
-        
-        ## todo, check invalid request or not, refresh token if possible
-        rv = json.loads(httpreq.response.body)
-        return rv.get("result") or httpreq.response.body
+            access_token = kwargs.get("access_token")
+            if not access_token:
+                access_token = mtoauth.valid_access_token()
+                ## only client's own token can be refreshed and replayed
+                refreshable = bool(access_token)
+            if access_token:
+                params["access_token"] = access_token
+            elif self.auth == AUTHENTIC:
+                raise MTApiException("Authentic method need an access_token")
+            if self.auth == VERIFIED:
+                params["client_id"] = mtoauth.client_id
+                params["client_secret"] = mtoauth.client_secret
         
-    return _call
-
-def verified_method(path, method="GET", required_params=[], **kwargs):
+        httpreq = mtoauth.http_request(self.url(mtoauth), self.method, params,
+            endpoint=self.path)
+        httpreq.refreshable = refreshable
+        return httpreq
     
-    @check_required_params(path, required_params, **kwargs)
-    def _call(mtoauth, *args, **kwargs):
-        params = kwargs.copy()
-        params.update(mtoauth.default_params())
+    def method_function(self):
+        ## plain function so it binds to MTOAuth like any method
+        build_request, cacheable = self.build_request, self.cacheable
         
-        _access_token = kwargs.get("access_token") or mtoauth.access_token
-        if _access_token:
-            params["access_token"] = _access_token
-            
-        params["client_id"] = mtoauth.client_id
-        params["client_secret"] = mtoauth.client_secret
-        
-        url = mtoauth.api_url(path)
-        httpreq = HttpReq(url, method, params)
-        httpreq.execute()
+        def _call(mtoauth, **kwargs):
+            return mtoauth.perform_request(build_request(mtoauth, **kwargs),
+                cacheable)
         
-        ## store last request state
-        mtoauth.last_request = httpreq
-        
-        ## todo, check invalid request or not, refresh token if possible
-        rv = json.loads(httpreq.response.body)
-        return rv.get("result") or httpreq.response.body
-        
-    return _call
+        _call.endpoint = self
+        ## used by MTOAuth.batch to build request without executing it
+        _call.build_request = build_request
+        _call.cacheable = cacheable
+        return _call
+
+def parse_body(body):
+    rv = json.loads(body)
+    return rv.get("result") or body
+
+def parse_result(httpreq):
+    return parse_body(httpreq.response.body)
+
+def dump_result(result):
+    ## body parse_body decode to result again
+    if isinstance(result, str):
+        ## raw body returned when it had no result
+        return result
+    return json.dumps(dict(result=result))
+
+def anonym_method(path, method="GET", required_params=(), wiki_path=None):
+    return Endpoint(path, method, ANONYM, required_params, wiki_path).method_function()
+
+def authentic_method(path, method="GET", required_params=(), wiki_path=None):
+    return Endpoint(path, method, AUTHENTIC, required_params, wiki_path).method_function()
+
+def verified_method(path, method="GET", required_params=(), wiki_path=None):
+    return Endpoint(path, method, VERIFIED, required_params, wiki_path).method_function()
+
+def register_endpoints(cls):
+    """
+    Name endpoints defined in cls and list them in cls.endpoints.
+    """
+    endpoints = dict(getattr(cls, "endpoints", {}))
+    for name, value in cls.__dict__.items():
+        endpoint = getattr(value, "endpoint", None)
+        if isinstance(endpoint, Endpoint):
+            endpoint.name = name
+            endpoints[name] = endpoint
+    cls.endpoints = endpoints
+    return cls
 
 class MTOAuth(object):
     api_domain = "http://api.mindtalk.com"
@@ -251,13 +492,33 @@ class MTOAuth(object):
     
     # shorthen url, just redirect
     wiki_endpoint = "http://mndt.lk/dev/"
-    last_request = None
+    ## keep raw body in last_request.response after it's decoded
+    keep_response_body = False
+    
+    ## paging parameters used by iter_* methods
+    page_offset_param = "offset"
+    page_limit_param = "limit"
+    page_size = 20
+    
+    ## stream_result pause download while this many items wait to be
+    ## consumed, compressed response can decode to many items at once
+    stream_max_pending = 1000
+    
+    ## endpoints return the result, not a future (see AsyncMTOAuth)
+    blocking = True
     
     access_token = None
     refresh_token = None
+    ## unix time access_token expire, None when unknown
+    token_expires_at = None
 
     def __init__(self, client_id, client_secret, redirect_uri, api_key,
-            scopes=None):
+            scopes=None, pool=None, pool_size=10, cache=None,
+            conditional_cache=None, max_response_size=None,
+            connect_timeout=10, timeout=60, retry_policy=None,
+            circuit_breaker=None, refresh_margin=None, on_token_refresh=None,
+            rate_limiter=None, coalesce=True, metrics=None,
+            on_upload_progress=None, accept_encoding="gzip, deflate"):
         self.client_id = client_id
         self.client_secret = client_secret
         self.redirect_uri = redirect_uri
@@ -266,6 +527,86 @@ class MTOAuth(object):
             scopes = ",".join(scopes)
         self.scopes = scopes or "basic"
         
+        ## curl handles shared by every request made by this client,
+        ## pass same pool to several MTOAuth to share connections
+        self.pool = pool if pool is not None else CurlPool(pool_size)
+        
+        ## ResponseCache for anonymous GET endpoints, disabled by default
+        self.cache = cache
+        ## ConditionalCache to revalidate GET endpoints with ETag or
+        ## Last-Modified, disabled by default
+        self.conditional_cache = conditional_cache
+        self.max_response_size = max_response_size
+        
+        ## in seconds, None disable the timeout
+        self.connect_timeout = connect_timeout
+        self.timeout = timeout
+        ## compression asked to the server, None disable it
+        self.accept_encoding = accept_encoding
+        ## RetryPolicy(max_retries=0) disable retry
+        self.retry_policy = retry_policy if retry_policy is not None \
+            else RetryPolicy()
+        ## CircuitBreaker, can be shared by several clients, disabled by default
+        self.circuit_breaker = circuit_breaker
+        ## RateLimiter, can be shared by several clients, disabled by default
+        self.rate_limiter = rate_limiter
+        
+        ## identical concurrent anonymous GET share one request
+        self.coalesce = coalesce
+        self._inflight = SingleFlight()
+        
+        ## Metrics, can be shared by several clients, disabled by default
+        self.metrics = metrics
+        ## fn(httpreq) called before every attempt to send a request,
+        ## fn(httpreq, error) after it, error is None when curl succeeded
+        self.before_request_hooks = []
+        self.after_request_hooks = []
+        ## called with (httpreq, uploaded bytes, total bytes or None) while
+        ## POST with upload value is sent
+        self.on_upload_progress = on_upload_progress
+        
+        ## refresh access_token this many seconds before it expire
+        self.refresh_margin = refresh_margin
+        ## called with (access_token, refresh_token) after token refreshed
+        self.on_token_refresh = on_token_refresh
+        self._refresh_flight = SingleFlight()
+        ## last_request of every thread
+        self._local = threading.local()
+    
+    @property
+    def last_request(self):
+        return getattr(self._local, "last_request", None)
+    
+    @last_request.setter
+    def last_request(self, httpreq):
+        self._local.last_request = httpreq
+    
+    def session(self, access_token, refresh_token=None, expires_in=None,
+            on_token_refresh=None):
+        """
+        Return client for one user, sharing configuration, pool, caches,
+        rate limiter and metrics with this one. Only the token and
+        last_request are its own, so it's cheap enough to make one per web
+        request, e.g:
+            mtoauth.session(user.access_token, user.refresh_token).my_info()
+        """
+        session = self.__class__.__new__(self.__class__)
+        session.__dict__.update(self.__dict__)
+        session._local = threading.local()
+        session.set_token(access_token, refresh_token, expires_in)
+        if on_token_refresh is not None:
+            session.on_token_refresh = on_token_refresh
+        return session
+        
+    def http_request(self, url, method="GET", params={}, header={},
+            endpoint=None):
+        httpreq = HttpReq(url, method, params, header, pool=self.pool,
+            endpoint=endpoint, max_size=self.max_response_size,
+            connect_timeout=self.connect_timeout, timeout=self.timeout,
+            accept_encoding=self.accept_encoding)
+        httpreq.upload_progress = self.on_upload_progress
+        return httpreq
+        
     def default_params(self):
         default_params = dict(
             rf=self.return_format,
@@ -312,19 +653,414 @@ class MTOAuth(object):
             redirect_uri=self.redirect_uri
         )
         
-        httpreq = HttpReq(self.access_token_url(), "GET", params)
+        httpreq = self.http_request(self.access_token_url(), "GET", params)
         httpreq.execute()
         
         if httpreq.response.status_code == 200:
-            raw_data = cgi.parse_qs(httpreq.response.body)
+            raw_data = urlparse.parse_qs(httpreq.response.body)
             token = raw_data["access_token"][0], raw_data["refresh_token"][0]
             return True, token
         
         return False, httpreq
     
-    def set_token(self, access_token, refresh_token):
+    def set_token(self, access_token, refresh_token, expires_in=None):
         self.access_token = access_token
         self.refresh_token = refresh_token
+        self.token_expires_at = time.time() + float(expires_in) \
+            if expires_in else None
+    
+    def refresh_access_token(self):
+        """
+        Get new access_token using refresh_token and store it.
+        """
+        if not self.refresh_token:
+            raise MTApiException("Cannot refresh access_token without refresh_token")
+        
+        params = dict(
+            grant_type="refresh_token",
+            refresh_token=self.refresh_token,
+            client_id=self.client_id,
+            client_secret=self.client_secret
+        )
+        
+        httpreq = self.http_request(self.access_token_url(), "GET", params)
+        httpreq.execute()
+        
+        raw_data = urlparse.parse_qs(httpreq.response.body)
+        if httpreq.response.status_code != 200 or "access_token" not in raw_data:
+            raise MTApiException("Cannot refresh access_token, status %s" % (
+                httpreq.response.status_code))
+        
+        access_token = raw_data["access_token"][0]
+        refresh_token = raw_data.get("refresh_token", [self.refresh_token])[0]
+        expires_in = raw_data.get("expires_in", [None])[0]
+        self.set_token(access_token, refresh_token, expires_in)
+        if self.on_token_refresh is not None:
+            self.on_token_refresh(access_token, refresh_token)
+        return access_token
+    
+    def _refresh_token_once(self, expired_token):
+        ## concurrent callers holding the same expired token share one
+        ## refresh, sessions of the same user included
+        def _refresh():
+            ## other caller may already refreshed it
+            if self.access_token == expired_token:
+                self.refresh_access_token()
+            return self.access_token, self.refresh_token, self.token_expires_at
+        token = self._refresh_flight.do(expired_token, _refresh)
+        if self.access_token == expired_token:
+            ## refreshed by another session
+            self.access_token, self.refresh_token, self.token_expires_at = token
+            if self.on_token_refresh is not None:
+                self.on_token_refresh(self.access_token, self.refresh_token)
+        return self.access_token
+    
+    def token_expiring(self):
+        ## about to expire and should be refreshed before use, needs
+        ## refresh_margin
+        return self.refresh_margin is not None and bool(self.refresh_token) \
+            and self.token_expires_at is not None \
+            and self.token_expires_at - time.time() < self.refresh_margin
+    
+    def valid_access_token(self):
+        """
+        Return access_token, refreshed first when it's about to expire and
+        refresh_margin is set.
+        """
+        if self.token_expiring():
+            return self._refresh_token_once(self.access_token)
+        return self.access_token
+    
+    def is_token_expired(self, httpreq):
+        """
+        Whether api rejected request because of expired / invalid token,
+        override when api report it differently.
+        """
+        if not httpreq.refreshable:
+            return False
+        response = httpreq.response
+        return response.status_code == 401 \
+            or "invalid_token" in response.header.get("www-authenticate", "")
+    
+    def _with_fresh_token(self, httpreq):
+        """
+        Refresh the token httpreq was made with, return copy of httpreq
+        using the new token.
+        """
+        access_token = self._refresh_token_once(httpreq.params.get("access_token"))
+        if not httpreq.can_replay():
+            raise MTApiException("Upload to %s can't be sent again with "
+                "refreshed access_token" % httpreq.endpoint)
+        fresh = httpreq.copy()
+        fresh.params = dict(httpreq.params, access_token=access_token)
+        ## replay only once
+        fresh.refreshable = False
+        return fresh
+    
+    def perform_request(self, httpreq, cacheable=False):
+        """
+        Execute request built by endpoint and return its unwrapped result,
+        override to change how requests are executed (see AsyncMTOAuth).
+        """
+        return self.execute_request(httpreq, cacheable)[0]
+    
+    def execute_request(self, httpreq, cacheable=False):
+        """
+        Same as perform_request but return (result, executed httpreq), the
+        httpreq is None when result came from response cache.
+        """
+        hit, rv = self._before_request(httpreq, cacheable)
+        if hit:
+            return rv, None
+        
+        if cacheable and self.coalesce:
+            rv, httpreq = self._inflight.do(self._coalesce_key(httpreq),
+                self._perform, httpreq, cacheable)
+            ## waiting callers share the request done by the first one
+            self.last_request = httpreq
+            return rv, httpreq
+        return self._perform(httpreq, cacheable)
+    
+    def _coalesce_key(self, httpreq):
+        return httpreq.method, cache_key(httpreq.endpoint, httpreq.params)
+    
+    def _perform(self, httpreq, cacheable):
+        httpreq = self._execute_with_retry(httpreq)
+        if self.is_token_expired(httpreq):
+            httpreq = self._execute_with_retry(self._with_fresh_token(httpreq))
+        return self._after_request(httpreq, cacheable), httpreq
+    
+    def _execute_with_retry(self, httpreq):
+        ## return the last executed httpreq (a copy when retried)
+        attempt = 0
+        while True:
+            self._check_circuit(httpreq)
+            wait = self._before_send(httpreq)
+            if wait > 0:
+                time.sleep(wait)
+            error = None
+            try:
+                httpreq.execute()
+            except pycurl.error as e:
+                error = e
+            
+            delay = self._retry_delay(httpreq, error, attempt)
+            if delay is None:
+                break
+            time.sleep(delay)
+            httpreq = httpreq.copy()
+            attempt += 1
+        
+        if error is not None:
+            raise error
+        return httpreq
+    
+    def _check_circuit(self, httpreq):
+        if self.circuit_breaker is not None:
+            self.circuit_breaker.check(httpreq.host())
+    
+    def _before_send(self, httpreq):
+        ## run hooks, return seconds to wait before sending httpreq
+        for hook in self.before_request_hooks:
+            hook(httpreq)
+        if self.rate_limiter is None:
+            return 0
+        return self.rate_limiter.reserve(httpreq)
+    
+    def _retry_delay(self, httpreq, error, attempt, replayable=True):
+        """
+        Record request outcome in circuit breaker, rate limiter and
+        metrics, return seconds to wait before retrying it or None when it
+        must not be retried (or can't be, replayable False).
+        """
+        if self.rate_limiter is not None and error is None:
+            self.rate_limiter.update(httpreq)
+        if self.circuit_breaker is not None:
+            if error is not None or httpreq.response.status_code >= 500:
+                self.circuit_breaker.failure(httpreq.host())
+            else:
+                self.circuit_breaker.success(httpreq.host())
+        delay = self.retry_policy.delay(httpreq, error, attempt)
+        if delay is not None and not (replayable and httpreq.can_replay()):
+            delay = None
+        self._record(httpreq, error, delay is not None)
+        return delay
+    
+    def _record(self, httpreq, error, retried=False):
+        if self.metrics is not None:
+            self.metrics.record(httpreq, error, retried)
+        for hook in self.after_request_hooks:
+            hook(httpreq, error)
+    
+    def _before_request(self, httpreq, cacheable=False):
+        """
+        Return (True, result) when request can be answered without
+        touching the network, (False, None) otherwise.
+        """
+        if cacheable and self.cache is not None:
+            body = self.cache.get(httpreq.endpoint, httpreq.params)
+            if body is not None:
+                if self.metrics is not None:
+                    self.metrics.cache_hit(httpreq.endpoint)
+                return True, parse_body(body)
+        
+        conditional_cache = self.conditional_cache
+        if conditional_cache is not None and httpreq.method == "GET":
+            entry = conditional_cache.get(httpreq.endpoint, httpreq.params)
+            if entry is not None:
+                header = httpreq.header.copy()
+                header.update(conditional_cache.request_header(entry))
+                httpreq.header = header
+                httpreq.conditional = entry
+        
+        return False, None
+    
+    def _after_request(self, httpreq, cacheable=False):
+        ## store last request state
+        self.last_request = httpreq
+        
+        response = httpreq.response
+        if response.status_code == 304 and httpreq.conditional is not None:
+            ## not modified, serve stored result without decoding again
+            rv, body = httpreq.conditional["result"], None
+            self.conditional_cache.revalidated(httpreq.endpoint)
+        else:
+            rv, body = parse_result(httpreq), response.body
+            if self.conditional_cache is not None and httpreq.method == "GET" \
+                    and response.status_code == 200:
+                self.conditional_cache.store(httpreq.endpoint, httpreq.params,
+                    response, rv)
+        
+        if cacheable and self.cache is not None \
+                and response.status_code in (200, 304):
+            if body is None:
+                ## conditional cache keep only the decoded result
+                body = dump_result(rv)
+            self.cache.set(httpreq.endpoint, httpreq.params, body)
+        
+        if not self.keep_response_body:
+            response.clear_body()
+        return rv
+    
+    def stream_result(self, name, **params):
+        """
+        Generator of `result` items of endpoint, items are decoded while
+        response is downloaded so memory stay flat for big response, e.g:
+            for post in mtoauth.stream_result("channel_stream", id=1):
+                print post
+        Response cache and conditional cache are not used. Failed request
+        is retried and expired token refreshed as long as no item was
+        yielded yet.
+        """
+        endpoint = getattr(self, name)
+        httpreq = endpoint.build_request(self, **params)
+        attempt = 0
+        while True:
+            parser = ResultStreamParser()
+            
+            def _consume(buf, parser=parser):
+                if len(parser.items) >= self.stream_max_pending:
+                    return pycurl.WRITEFUNC_PAUSE
+                parser.feed(buf)
+            
+            httpreq.body_consumer = _consume
+            self._check_circuit(httpreq)
+            wait = self._before_send(httpreq)
+            if wait > 0:
+                time.sleep(wait)
+            ## items given to the caller can't be taken back, the stream is
+            ## not restarted once one was yielded
+            yielded = False
+            error = None
+            try:
+                for _ in iter_perform(httpreq):
+                    while parser.items:
+                        yielded = True
+                        yield parser.items.popleft()
+            except pycurl.error as e:
+                error = e
+            
+            delay = self._retry_delay(httpreq, error, attempt, not yielded)
+            if delay is not None:
+                time.sleep(delay)
+                httpreq = httpreq.copy()
+                attempt += 1
+            elif error is not None:
+                raise error
+            elif not yielded and self.is_token_expired(httpreq):
+                httpreq = self._with_fresh_token(httpreq)
+                attempt = 0
+            else:
+                break
+        
+        ## store last request state
+        self.last_request = httpreq
+        
+        ## response without result array, e.g error or single object
+        rv = parser.close()
+        if rv is None:
+            return
+        result = rv.get("result")
+        if isinstance(result, list):
+            for item in result:
+                yield item
+        elif result:
+            yield result
+        else:
+            raise MTApiException("Error during request %s\n%s" % (
+                httpreq.endpoint, json.dumps(rv)))
+    
+    def batch(self, calls, concurrency=None):
+        """
+        Run several endpoint calls at once using curl multi interface.
+        calls is list of (endpoint_name, params), e.g:
+            mtoauth.batch([("user_info", dict(name="rizkyabdilah")),
+                ("channel_info", dict(id=1))])
+        Return list of (error, result) in the same order as calls, error is
+        None when the call succeeded.
+        """
+        ## every running transfer hold one pooled handle
+        concurrency = min(concurrency or self.pool.maxsize, self.pool.maxsize)
+        
+        results = [None] * len(calls)
+        httpreqs = []
+        pending = []
+        ## identical anonymous GET in the batch are requested once
+        shared = {}
+        duplicates = []
+        for i, (name, params) in enumerate(calls):
+            try:
+                endpoint = getattr(self, name)
+                httpreq = endpoint.build_request(self, **params)
+                hit, rv = self._before_request(httpreq, endpoint.cacheable)
+                key = None
+                if not hit and endpoint.cacheable and self.coalesce:
+                    key = self._coalesce_key(httpreq)
+            except Exception as e:
+                ## e.g unknown endpoint, missing param, non ascii unicode
+                ## param, curl error while refreshing expiring token
+                results[i] = (e, None)
+                continue
+            if hit:
+                results[i] = (None, rv)
+                continue
+            if key is not None:
+                if key in shared:
+                    duplicates.append((i, shared[key]))
+                    continue
+                shared[key] = i
+            httpreqs.append(httpreq)
+            pending.append((i, endpoint.cacheable))
+        
+        attempt = 0
+        while httpreqs:
+            running = []
+            for (i, cacheable), httpreq in zip(pending, httpreqs):
+                try:
+                    self._check_circuit(httpreq)
+                except CircuitOpenError as e:
+                    results[i] = (e, None)
+                    continue
+                running.append(((i, cacheable), httpreq))
+            
+            ## failed requests are retried together in next round
+            errors = execute_multi([r[1] for r in running], concurrency,
+                throttle=self._before_send)
+            httpreqs, pending, delays = [], [], []
+            for ((i, cacheable), httpreq), error in zip(running, errors):
+                try:
+                    delay = self._retry_delay(httpreq, error, attempt)
+                except Exception as e:
+                    ## e.g raising after_request hook
+                    results[i] = (e, None)
+                    continue
+                if delay is not None:
+                    httpreqs.append(httpreq.copy())
+                    pending.append((i, cacheable))
+                    delays.append(delay)
+                elif error is not None:
+                    results[i] = (error, None)
+                elif self.is_token_expired(httpreq):
+                    try:
+                        httpreqs.append(self._with_fresh_token(httpreq))
+                    except (MTApiException, pycurl.error) as e:
+                        ## e.g auth host unreachable, other results are kept
+                        results[i] = (e, None)
+                        continue
+                    pending.append((i, cacheable))
+                else:
+                    try:
+                        results[i] = (None, self._after_request(httpreq, cacheable))
+                    except Exception as e:
+                        results[i] = (e, None)
+            
+            if delays:
+                time.sleep(max(delays))
+            attempt += 1
+        
+        for i, j in duplicates:
+            results[i] = results[j]
+        return results
 
     ## anonym user
     user_info = anonym_method(path="/user/info",
@@ -499,3 +1235,22 @@ class MTOAuth(object):
         required_params=["id", "message"], wiki_path="WhisperWriteResponse")
     whisper_get_responses = authentic_method(path="/whisper/get_responses", method="POST",
         required_params=["id"], wiki_path="WhisperGetResponses")
+
+    ## lazy iterators over paged endpoints
+    iter_user_supporters = paginated("user_supporters")
+    iter_user_supporting = paginated("user_supporting")
+    iter_user_search = paginated("user_search")
+    iter_user_channels = paginated("user_channels")
+    iter_user_stream = paginated("user_stream")
+    iter_channel_search = paginated("channel_search")
+    iter_channel_stream = paginated("channel_stream")
+    iter_channel_members = paginated("channel_members")
+    iter_post_likes = paginated("post_likes")
+    iter_post_responses = paginated("post_responses")
+    iter_iam_supporting = paginated("iam_supporting")
+    iter_my_supporter = paginated("my_supporter")
+    iter_my_stream = paginated("my_stream")
+    iter_my_notifications = paginated("my_notifications")
+    iter_whisper_get_all = paginated("whisper_get_all")
+
+register_endpoints(MTOAuth)
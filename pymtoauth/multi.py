@@ -0,0 +1,147 @@
+"""
+Run several HttpReq concurrently on a single pycurl.CurlMulti loop.
+"""
+
+import time
+import pycurl
+
+def _acquire_multi(pool):
+    return pool.acquire_multi() if pool is not None else pycurl.CurlMulti()
+
+def _release_multi(pool, multi):
+    if pool is not None:
+        pool.release_multi(multi)
+    else:
+        multi.close()
+
+def execute_multi(httpreqs, concurrency=10, select_timeout=1.0, throttle=None):
+    """
+    Execute all httpreqs, at most `concurrency` transfers running at the
+    same time. Return list of errors in the same order as httpreqs, None
+    for request that finished without curl error.
+    throttle(httpreq), when given, return seconds to wait before starting
+    httpreq (see RateLimiter.reserve).
+    """
+    errors = [None] * len(httpreqs)
+    pending = list(enumerate(httpreqs))
+    pending.reverse()
+    active = {}
+    ## next request to start, (start_at, index, httpreq)
+    waiting = None
+
+    pool = httpreqs[0].pool if httpreqs else None
+    multi = _acquire_multi(pool)
+    try:
+        while pending or active or waiting:
+            ## waiting request can't get a pooled handle
+            starved = False
+            while len(active) < concurrency:
+                if waiting is None:
+                    if not pending:
+                        break
+                    index, httpreq = pending.pop()
+                    wait = throttle(httpreq) if throttle is not None else 0
+                    waiting = (time.time() + wait, index, httpreq)
+                start_at, index, httpreq = waiting
+                wait = start_at - time.time()
+                if wait > 0:
+                    if active:
+                        break
+                    time.sleep(wait)
+                curl = None
+                if not httpreq.already_prepared and httpreq.pool is not None:
+                    ## handles of our transfers are released only by this
+                    ## loop, blocking while they wait would deadlock with
+                    ## other threads doing the same
+                    curl = httpreq.pool.acquire(block=not active)
+                    if curl is None:
+                        starved = True
+                        break
+                waiting = None
+                try:
+                    if not httpreq.already_prepared:
+                        httpreq.prepare(curl)
+                except Exception as e:
+                    ## handle already given back by prepare
+                    errors[index] = e
+                    continue
+                multi.add_handle(httpreq.curl)
+                active[id(httpreq.curl)] = index
+
+            while True:
+                ret, num_handles = multi.perform()
+                if ret != pycurl.E_CALL_MULTI_PERFORM:
+                    break
+
+            while True:
+                num_queued, ok_list, err_list = multi.info_read()
+                for curl in ok_list:
+                    index = active.pop(id(curl))
+                    multi.remove_handle(curl)
+                    httpreqs[index].finish()
+                for curl, errno, errmsg in err_list:
+                    index = active.pop(id(curl))
+                    multi.remove_handle(curl)
+                    httpreqs[index].close(discard=True)
+                    errors[index] = httpreqs[index].curl_error(errno, errmsg)
+                if num_queued == 0:
+                    break
+
+            if active:
+                timeout = select_timeout
+                if waiting is not None and not starved:
+                    timeout = max(0, min(timeout, waiting[0] - time.time()))
+                multi.select(timeout)
+    finally:
+        ## interrupted, don't leak pooled handles
+        for index in active.values():
+            httpreq = httpreqs[index]
+            multi.remove_handle(httpreq.curl)
+            httpreq.close(discard=True)
+        _release_multi(pool, multi)
+
+    return errors
+
+def iter_perform(httpreq, select_timeout=1.0):
+    """
+    Execute single httpreq step by step, yield every time curl made some
+    progress so caller can consume data received so far, transfer paused
+    by httpreq.body_consumer is resumed after that. Closing the generator
+    before it's exhausted abort the transfer.
+    """
+    if not httpreq.already_prepared:
+        httpreq.prepare()
+
+    multi = _acquire_multi(httpreq.pool)
+    multi.add_handle(httpreq.curl)
+    finished = False
+    try:
+        while True:
+            while True:
+                ret, num_handles = multi.perform()
+                if ret != pycurl.E_CALL_MULTI_PERFORM:
+                    break
+            if not num_handles:
+                break
+            yield
+            if httpreq.paused:
+                ## body consumer caught up, resume at once
+                httpreq.paused = False
+                httpreq.curl.pause(pycurl.PAUSE_CONT)
+                continue
+            multi.select(select_timeout)
+
+        num_queued, ok_list, err_list = multi.info_read()
+        multi.remove_handle(httpreq.curl)
+        finished = True
+        if err_list:
+            curl, errno, errmsg = err_list[0]
+            httpreq.close(discard=True)
+            raise httpreq.curl_error(errno, errmsg)
+        httpreq.finish()
+        yield
+    finally:
+        if not finished:
+            multi.remove_handle(httpreq.curl)
+            httpreq.close(discard=True)
+        _release_multi(httpreq.pool, multi)
@@ -0,0 +1,94 @@
+"""
+Lazy iterator over paged endpoints, see MTOAuth.iter_* methods.
+"""
+
+import threading
+
+class PageFetcher(threading.Thread):
+    """
+    Fetch one page in background thread.
+    """
+
+    def __init__(self, fetch, page):
+        threading.Thread.__init__(self)
+        self.daemon = True
+        self.fetch = fetch
+        self.page = page
+        self.result = None
+        self.error = None
+        self.start()
+
+    def run(self):
+        try:
+            self.result = self.fetch(self.page)
+        except Exception as e:
+            self.error = e
+
+    def get(self):
+        self.join()
+        if self.error is not None:
+            raise self.error
+        return self.result
+
+def iter_pages(fetch, page_size, max_items=None, max_pages=None,
+        prefetch=False):
+    """
+    Yield items of page 0, 1, 2, ... returned by fetch(page) until a page
+    shorter than page_size, or max_items / max_pages reached. With prefetch
+    next page is requested while current page is being consumed.
+    """
+    page = 0
+    count = 0
+    fetcher = PageFetcher(fetch, page) if prefetch else None
+    while max_pages is None or page < max_pages:
+        items = fetcher.get() if fetcher is not None else fetch(page)
+
+        last = len(items) < page_size \
+            or (max_pages is not None and page + 1 >= max_pages) \
+            or (max_items is not None and count + len(items) >= max_items)
+        if prefetch and not last:
+            fetcher = PageFetcher(fetch, page + 1)
+
+        for item in items:
+            yield item
+            count += 1
+            if max_items is not None and count >= max_items:
+                return
+
+        if last:
+            return
+        page += 1
+
+def paginated(name):
+    """
+    Build iterator method over paged endpoint `name`, e.g:
+        for post in mtoauth.iter_channel_stream(id=1, max_items=500):
+            print post
+    """
+    def _iter(mtoauth, max_items=None, max_pages=None, prefetch=False,
+            page_size=None, **params):
+        if not mtoauth.blocking:
+            ## endpoint return future, nothing to iterate
+            raise TypeError("iter_%s needs blocking MTOAuth" % name)
+        page_size = page_size or mtoauth.page_size
+        endpoint = getattr(mtoauth, name)
+
+        def _fetch(page):
+            kwargs = params.copy()
+            kwargs[mtoauth.page_offset_param] = page * page_size
+            kwargs[mtoauth.page_limit_param] = page_size
+            rv, httpreq = mtoauth.execute_request(
+                endpoint.build_request(mtoauth, **kwargs), endpoint.cacheable)
+            ## error and empty page both come back as raw body, see
+            ## parse_body. httpreq is None when page came from cache
+            if httpreq is not None and httpreq.response.status_code >= 400:
+                from mtoauth import MTApiException
+                raise MTApiException("Error during request %s page %d, "
+                    "status %s" % (endpoint.endpoint.path, page,
+                    httpreq.response.status_code))
+            return rv if isinstance(rv, list) else []
+
+        return iter_pages(_fetch, page_size, max_items, max_pages, prefetch)
+
+    _iter.__name__ = "iter_" + name
+    return _iter
@@ -0,0 +1,131 @@
+"""
+Pool of reusable pycurl.Curl handles.
+
+libcurl keeps a connection cache per easy handle, so reusing a handle
+instead of creating a new one for every request keeps the TCP (and TLS)
+connection to the api server alive between calls. Handle added to a
+CurlMulti use the multi's cache instead, so multis are pooled too, and
+with pycurl >= 7.44 every handle share one cache (CurlShare).
+"""
+
+import threading
+import time
+import pycurl
+
+class CurlPool(object):
+
+    def __init__(self, maxsize=10, keepalive=True):
+        self.maxsize = maxsize
+        self.keepalive = keepalive
+        self._idle = []
+        self._created = 0
+        self._cond = threading.Condition(threading.Lock())
+        ## idle CurlMulti, kept for their connection cache
+        self._multis = []
+        ## connection opened by a batch is reused by single call and the
+        ## other way around
+        self.share = None
+        if keepalive and hasattr(pycurl, "LOCK_DATA_CONNECT"):
+            self.share = pycurl.CurlShare()
+            self.share.setopt(pycurl.SH_SHARE, pycurl.LOCK_DATA_CONNECT)
+            self.share.setopt(pycurl.SH_SHARE, pycurl.LOCK_DATA_DNS)
+            self.share.setopt(pycurl.SH_SHARE, pycurl.LOCK_DATA_SSL_SESSION)
+
+    def _new_handle(self):
+        return pycurl.Curl()
+
+    def acquire(self, block=True, timeout=None):
+        """
+        Get a handle from the pool, create new one if pool not full yet.
+        Block until other thread release a handle when pool is exhausted.
+        """
+        deadline = time.time() + timeout if timeout is not None else None
+        with self._cond:
+            while not self._idle and self._created >= self.maxsize:
+                if not block:
+                    return None
+                if deadline is None:
+                    self._cond.wait()
+                else:
+                    remaining = deadline - time.time()
+                    if remaining <= 0:
+                        return None
+                    self._cond.wait(remaining)
+            if self._idle:
+                return self._idle.pop()
+            self._created += 1
+
+        try:
+            return self._new_handle()
+        except:
+            with self._cond:
+                self._created -= 1
+                self._cond.notify()
+            raise
+
+    def release(self, curl, discard=False):
+        """
+        Give the handle back to the pool. Handle is reset (all options
+        cleared) but its connection cache is kept. Pass discard=True when
+        the handle is in unknown state (e.g transfer aborted by error).
+        """
+        if not discard:
+            try:
+                curl.reset()
+            except pycurl.error:
+                discard = True
+
+        if discard:
+            curl.close()
+
+        with self._cond:
+            if discard:
+                self._created -= 1
+            else:
+                self._idle.append(curl)
+            self._cond.notify()
+
+    def setup(self, curl):
+        """
+        Apply pool level options, called every time handle is prepared
+        because reset() clear them.
+        """
+        curl.setopt(pycurl.FORBID_REUSE, 0 if self.keepalive else 1)
+        if self.keepalive and hasattr(pycurl, "TCP_KEEPALIVE"):
+            curl.setopt(pycurl.TCP_KEEPALIVE, 1)
+        if self.share is not None:
+            curl.setopt(pycurl.SHARE, self.share)
+
+    def acquire_multi(self):
+        """
+        Get an idle CurlMulti (or a new one) to run several transfers.
+        """
+        with self._cond:
+            if self._multis:
+                return self._multis.pop()
+        multi = pycurl.CurlMulti()
+        ## default limit follow the number of handles in the multi, it drop
+        ## connections while a finishing batch remove its handles
+        multi.setopt(pycurl.M_MAXCONNECTS, self.maxsize)
+        return multi
+
+    def release_multi(self, multi):
+        ## every handle must be removed from it already
+        with self._cond:
+            if self.keepalive:
+                self._multis.append(multi)
+                return
+        multi.close()
+
+    def close(self):
+        with self._cond:
+            idle, self._idle = self._idle, []
+            self._created -= len(idle)
+            multis, self._multis = self._multis, []
+        for curl in idle:
+            curl.close()
+        for multi in multis:
+            multi.close()
+
+    def __len__(self):
+        return len(self._idle)
@@ -0,0 +1,127 @@
+"""
+Client side rate limiter, token bucket per api_key (anonymous call) and
+per access_token (authentic call), adjusted by rate limit headers sent by
+the server.
+
+## Example
+limiter = RateLimiter(anonym_rate=20, authentic_rate=5,
+    endpoint_rates={"/user/search": 1})
+mtoauth = MTOAuth(rate_limiter=limiter, **config)
+"""
+
+import threading
+import time
+from collections import OrderedDict
+
+from retry import parse_retry_after
+
+class TokenBucket(object):
+
+    def __init__(self, rate, burst=None):
+        self.rate = float(rate)
+        self.capacity = float(burst or rate)
+        self.tokens = self.capacity
+        self.updated = time.time()
+        self._lock = threading.Lock()
+
+    def _refill(self, now):
+        self.tokens = min(self.capacity,
+            self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def reserve(self, n=1):
+        """
+        Take n tokens, return seconds caller must wait before sending.
+        Tokens can go negative so waiting callers are served in order.
+        """
+        with self._lock:
+            self._refill(time.time())
+            self.tokens -= n
+            if self.tokens >= 0:
+                return 0.0
+            return -self.tokens / self.rate
+
+    def limit(self, remaining, reset_in):
+        """
+        Server told only `remaining` request left for next reset_in seconds.
+        """
+        with self._lock:
+            self._refill(time.time())
+            if remaining <= 0:
+                self.tokens = min(self.tokens, -reset_in * self.rate)
+            else:
+                self.tokens = min(self.tokens, float(remaining))
+
+class RateLimiter(object):
+
+    def __init__(self, anonym_rate=10, authentic_rate=5, burst=None,
+            endpoint_rates=None, max_keys=10000):
+        self.anonym_rate = anonym_rate
+        self.authentic_rate = authentic_rate
+        self.burst = burst
+        ## requests per second for specific endpoint path, on top of the
+        ## api_key / access_token budget
+        self.endpoint_rates = endpoint_rates or {}
+        self.max_keys = max_keys
+        self._buckets = OrderedDict()
+        self._lock = threading.Lock()
+
+    def key(self, httpreq):
+        access_token = httpreq.params.get("access_token")
+        if access_token:
+            return ("authentic", access_token)
+        return ("anonym", httpreq.params.get("api_key"))
+
+    def _bucket(self, key, rate):
+        with self._lock:
+            bucket = self._buckets.pop(key, None)
+            if bucket is None:
+                bucket = TokenBucket(rate, self.burst)
+            ## most recently used last, forget old access_token first
+            self._buckets[key] = bucket
+            while len(self._buckets) > self.max_keys:
+                self._buckets.popitem(last=False)
+            return bucket
+
+    def _key_bucket(self, httpreq):
+        key = self.key(httpreq)
+        rate = self.authentic_rate if key[0] == "authentic" else self.anonym_rate
+        return key, self._bucket(key, rate)
+
+    def buckets(self, httpreq):
+        key, bucket = self._key_bucket(httpreq)
+        buckets = [bucket]
+        endpoint_rate = self.endpoint_rates.get(httpreq.endpoint)
+        if endpoint_rate:
+            buckets.append(self._bucket(key + (httpreq.endpoint,), endpoint_rate))
+        return buckets
+
+    def reserve(self, httpreq):
+        """
+        Return seconds to wait before httpreq can be sent.
+        """
+        return max([bucket.reserve() for bucket in self.buckets(httpreq)])
+
+    def update(self, httpreq):
+        """
+        Adjust budget from server response (X-RateLimit-* headers, 429).
+        """
+        header = httpreq.response.header
+        key, bucket = self._key_bucket(httpreq)
+
+        if httpreq.response.status_code == 429:
+            retry_after = parse_retry_after(header.get("retry-after"))
+            bucket.limit(0, retry_after if retry_after is not None else 1.0)
+            return
+
+        remaining = header.get("x-ratelimit-remaining")
+        if remaining is None:
+            return
+        try:
+            remaining = int(remaining)
+            reset = float(header.get("x-ratelimit-reset") or 1)
+        except ValueError:
+            return
+        ## reset is either epoch time or seconds from now
+        reset_in = reset - time.time() if reset > 1e9 else reset
+        bucket.limit(remaining, max(reset_in, 0.0))
@@ -0,0 +1,127 @@
+"""
+Retry policy with jittered exponential backoff and per host circuit
+breaker, used by MTOAuth to survive slow or failing api server.
+"""
+
+import random
+import threading
+import time
+import pycurl
+
+class CircuitOpenError(pycurl.error):
+    pass
+
+def parse_retry_after(value):
+    """
+    Retry-After header is either seconds or http date, return seconds.
+    """
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    ## rarely sent as date, don't pay email package import for every client
+    import email.utils
+    parsed = email.utils.parsedate_tz(value)
+    if parsed is None:
+        return None
+    return max(0.0, email.utils.mktime_tz(parsed) - time.time())
+
+class RetryPolicy(object):
+
+    ## request never reached the server, safe to retry any method
+    connect_errors = (pycurl.E_COULDNT_RESOLVE_HOST, pycurl.E_COULDNT_CONNECT)
+    ## retrying won't help
+    fatal_errors = (pycurl.E_FILESIZE_EXCEEDED, pycurl.E_WRITE_ERROR,
+        pycurl.E_ABORTED_BY_CALLBACK)
+
+    def __init__(self, max_retries=2, backoff=0.1, max_backoff=5.0,
+            max_retry_after=60.0, retry_statuses=(429, 500, 502, 503, 504),
+            idempotent_methods=("GET", "HEAD")):
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.max_retry_after = max_retry_after
+        self.retry_statuses = retry_statuses
+        self.idempotent_methods = idempotent_methods
+
+    def wait(self, attempt):
+        ## full jitter, spread retries of many workers
+        return random.uniform(0, min(self.max_backoff, self.backoff * 2 ** attempt))
+
+    def delay(self, httpreq, error, attempt):
+        """
+        Return seconds to wait before retrying failed request, None when
+        request should not be retried.
+        """
+        if attempt >= self.max_retries:
+            return None
+        idempotent = httpreq.method in self.idempotent_methods
+
+        if error is not None:
+            errno = error.args[0] if error.args else None
+            if errno in self.fatal_errors:
+                return None
+            if not idempotent and errno not in self.connect_errors:
+                return None
+            return self.wait(attempt)
+
+        status = httpreq.response.status_code
+        ## 429 means request was rejected, safe to send again
+        if status != 429 and not (idempotent and status in self.retry_statuses):
+            return None
+
+        retry_after = parse_retry_after(httpreq.response.header.get("retry-after"))
+        if retry_after is None:
+            return self.wait(attempt)
+        if retry_after > self.max_retry_after:
+            return None
+        return retry_after
+
+class CircuitBreaker(object):
+    """
+    Stop sending request to a host after failure_threshold consecutive
+    failures, let one trial request through every recovery_timeout seconds
+    until host is healthy again.
+    """
+
+    def __init__(self, failure_threshold=5, recovery_timeout=30.0):
+        self.failure_threshold = failure_threshold
+        self.recovery_timeout = recovery_timeout
+        ## host -> [consecutive failures, time circuit opened]
+        self._hosts = {}
+        self._lock = threading.Lock()
+
+    def allow(self, host):
+        with self._lock:
+            state = self._hosts.get(host)
+            if state is None or state[0] < self.failure_threshold:
+                return True
+            now = time.time()
+            if now - state[1] >= self.recovery_timeout:
+                ## half open, next trial only after another timeout
+                state[1] = now
+                return True
+            return False
+
+    def check(self, host):
+        if not self.allow(host):
+            raise CircuitOpenError(pycurl.E_COULDNT_CONNECT,
+                "Circuit open for %s, too many failures" % host)
+
+    def success(self, host):
+        with self._lock:
+            self._hosts.pop(host, None)
+
+    def failure(self, host):
+        with self._lock:
+            state = self._hosts.setdefault(host, [0, 0])
+            state[0] += 1
+            if state[0] >= self.failure_threshold:
+                state[1] = time.time()
+
+    def is_open(self, host):
+        with self._lock:
+            state = self._hosts.get(host)
+            return state is not None and state[0] >= self.failure_threshold
@@ -0,0 +1,206 @@
+"""
+Incremental decoder for `result` array of api response.
+
+Response body is scanned while it's being received, every item of the
+top level "result" array is decoded as soon as its closing delimiter
+arrive. The end of an item split between chunks is found by scanning only
+new data, then the item is decoded once.
+"""
+
+import collections
+import json
+import re
+
+_STRUCT = re.compile(r'[\[\]{}"]')
+## longest complete part of a string, stop at closing quote or at escape
+## not completely received yet
+_STRING_PART = re.compile(r'(?:[^"\\]|\\.)*', re.S)
+_SCALAR_END = re.compile(r'[\s,\]]')
+_ARRAY_START = re.compile(r'\s*:\s*\[')
+_SEPARATOR = re.compile(r'[\s,]*')
+
+class ResultStreamParser(object):
+
+    SEEK, ITEMS, DONE = range(3)
+
+    _decoder = json.JSONDecoder()
+
+    def __init__(self, key="result"):
+        self.key = key
+        self.state = self.SEEK
+        ## decoded items not consumed yet
+        self.items = collections.deque()
+        ## chunks received while seeking, decoded by close when there is no
+        ## result array
+        self._body = []
+        ## data not scanned yet
+        self._buf = ""
+        self._pos = 0
+        self._depth = 0
+        ## seeking: start of the string being scanned in self._buf, -1 when
+        ## dropped (too long to be the key). Items: inside a string
+        self._string = None
+        ## scanned parts of the unfinished item, None between items
+        self._item = None
+
+    def feed(self, data):
+        if self.state == self.DONE:
+            return
+        if self.state == self.SEEK:
+            self._body.append(data)
+        ## only the unfinished key or escape is left in self._buf
+        self._buf += data
+        if self.state == self.SEEK:
+            self._seek()
+        if self.state == self.ITEMS:
+            self._decode_items()
+
+    def _seek(self):
+        ## find top level "result": [ , tracking depth and skipping strings
+        buf, pos, depth, start = self._buf, self._pos, self._depth, self._string
+        while True:
+            if start is None:
+                m = _STRUCT.search(buf, pos)
+                if m is None:
+                    pos = len(buf)
+                    break
+                char, pos = m.group(), m.end()
+                if char in "[{":
+                    depth += 1
+                    continue
+                if char in "]}":
+                    depth -= 1
+                    continue
+                start = m.start()
+
+            pos = _STRING_PART.match(buf, pos).end()
+            if pos == len(buf) or buf[pos] != '"':
+                ## string not completely received yet
+                break
+            pos += 1
+            string, start = start, None
+            if string < 0 or depth != 1 or buf[string + 1:pos - 1] != self.key:
+                continue
+
+            m = _ARRAY_START.match(buf, pos)
+            if m is not None:
+                self.state = self.ITEMS
+                self._buf, self._body = buf[m.end():], None
+                self._depth, self._string = 0, False
+                return
+            if not buf[pos:].strip(" \t\r\n:"):
+                ## wait until the value start, scan the key again
+                pos = string
+                break
+
+        ## drop scanned data, keep the string that may still be the key
+        cut = pos
+        if start is not None and start >= 0 and depth == 1 \
+                and pos - start <= len(self.key) + 1:
+            cut = start
+        self._buf, self._pos, self._depth = buf[cut:], pos - cut, depth
+        if start is not None:
+            start = start - cut if start >= cut else -1
+        self._string = start
+
+    def _scan_item(self, buf, pos):
+        """
+        Scan unfinished item from pos, return (end, pos): end of the item
+        in buf, or None and where scanning stopped when it continue in next
+        data.
+        """
+        depth, string = self._depth, self._string
+        end = None
+        while True:
+            if string:
+                pos = _STRING_PART.match(buf, pos).end()
+                if pos == len(buf) or buf[pos] != '"':
+                    break
+                pos += 1
+                string = False
+                if depth == 0:
+                    end = pos
+                    break
+                continue
+            if depth == 0:
+                ## number, true, false or null, may be truncated until the
+                ## next separator arrive
+                m = _SCALAR_END.search(buf, pos)
+                if m is None:
+                    pos = len(buf)
+                    break
+                end = pos = m.start()
+                break
+            m = _STRUCT.search(buf, pos)
+            if m is None:
+                pos = len(buf)
+                break
+            char, pos = m.group(), m.end()
+            if char == '"':
+                string = True
+            elif char in "[{":
+                depth += 1
+            else:
+                depth -= 1
+                if depth == 0:
+                    end = pos
+                    break
+        self._depth, self._string = depth, string
+        return end, pos
+
+    def _decode_items(self):
+        buf, pos = self._buf, 0
+        while True:
+            start = pos
+            if self._item is None:
+                pos = start = _SEPARATOR.match(buf, pos).end()
+                if pos >= len(buf):
+                    break
+                char = buf[pos]
+                if char == "]":
+                    self.state = self.DONE
+                    self._buf = ""
+                    return
+                ## fast path, item completely received
+                try:
+                    item, end = self._decoder.raw_decode(buf, pos)
+                except ValueError:
+                    end = None
+                if end is not None and (isinstance(item, (dict, list, basestring))
+                        or (end < len(buf) and buf[end] in ",] \t\r\n")):
+                    self.items.append(item)
+                    pos = end
+                    continue
+                ## number may be truncated (e.g "3." of "3.5") and other
+                ## items are not complete, scan for their end
+                self._item = []
+                self._depth, self._string = 0, False
+                if char in "[{":
+                    self._depth = 1
+                    pos += 1
+                elif char == '"':
+                    self._string = True
+                    pos += 1
+
+            end, pos = self._scan_item(buf, pos)
+            if end is None:
+                self._item.append(buf[start:pos])
+                self._buf = buf[pos:]
+                return
+            self._item.append(buf[start:end])
+            text, self._item = "".join(self._item), None
+            self.items.append(self._decoder.decode(text))
+            pos = end
+        self._buf = ""
+
+    def close(self):
+        """
+        Call when body completely received. Return whole decoded document
+        when it has no "result" array, None otherwise.
+        """
+        if self.state == self.ITEMS:
+            raise ValueError("Incomplete response, result array not closed")
+        if self.state == self.SEEK:
+            body, self._body, self._buf = "".join(self._body), [], ""
+            return json.loads(body)
+        return None
@@ -0,0 +1,210 @@
+"""
+Streaming multipart/form-data body for POST request, read by curl
+READFUNCTION piece by piece instead of being built in memory.
+
+Upload value can be a file-like object (anything with read()), a buffer
+(bytearray, memoryview) or an iterator / generator of str chunks, e.g:
+    mtoauth.post_create_article(title="x", photo=open("a.jpg", "rb"))
+    mtoauth.post_create_article(title="x", photo=memoryview(jpeg_bytes))
+    mtoauth.post_create_article(title="x", photo=iter_chunks(response))
+"""
+
+import binascii
+import os
+
+try:
+    BUFFER_TYPES = (bytearray, memoryview, buffer)
+except NameError:
+    BUFFER_TYPES = (bytearray, memoryview)
+
+def is_upload(value):
+    if isinstance(value, basestring):
+        return False
+    return isinstance(value, BUFFER_TYPES) or hasattr(value, "read") \
+        or hasattr(value, "next") or hasattr(value, "__next__")
+
+class BytesPart(object):
+    """
+    Sliced on read, never copied as a whole.
+    """
+
+    def __init__(self, data):
+        try:
+            self.data = memoryview(data)
+        except TypeError:
+            ## python 2 buffer
+            self.data = data
+        self.size = len(self.data)
+        self.pos = 0
+
+    def read(self, size):
+        chunk = self.data[self.pos:self.pos + size]
+        self.pos += len(chunk)
+        return chunk.tobytes() if isinstance(chunk, memoryview) else str(chunk)
+
+    def can_rewind(self):
+        return True
+
+    def rewind(self):
+        self.pos = 0
+        return True
+
+class FilePart(object):
+
+    def __init__(self, fileobj):
+        self.fileobj = fileobj
+        try:
+            self.start = fileobj.tell()
+        except (AttributeError, IOError, ValueError):
+            self.start = None
+        self.size = None
+        try:
+            self.size = os.fstat(fileobj.fileno()).st_size - (self.start or 0)
+        except (AttributeError, IOError, OSError, ValueError):
+            if self.start is not None:
+                ## in memory file, e.g StringIO
+                fileobj.seek(0, 2)
+                self.size = fileobj.tell() - self.start
+                fileobj.seek(self.start)
+        self.started = False
+
+    def read(self, size):
+        self.started = True
+        return self.fileobj.read(size)
+
+    def can_rewind(self):
+        return not self.started or self.start is not None
+
+    def rewind(self):
+        if not self.started:
+            return True
+        if self.start is None:
+            return False
+        self.fileobj.seek(self.start)
+        self.started = False
+        return True
+
+class IterPart(object):
+
+    def __init__(self, iterator):
+        self.iterator = iterator
+        self.size = None
+        self.started = False
+        self._rest = None
+
+    def read(self, size):
+        self.started = True
+        while not self._rest:
+            try:
+                chunk = next(self.iterator)
+            except StopIteration:
+                return ""
+            if isinstance(chunk, unicode):
+                chunk = chunk.encode("utf-8")
+            self._rest = BytesPart(chunk)
+        chunk = self._rest.read(size)
+        if self._rest.pos >= self._rest.size:
+            self._rest = None
+        return chunk
+
+    def can_rewind(self):
+        ## generator can't be restarted
+        return not self.started
+
+    def rewind(self):
+        return self.can_rewind()
+
+class MultipartBody(object):
+
+    def __init__(self, params, sources=None):
+        self.boundary = binascii.hexlify(os.urandom(16))
+        self.parts = []
+        ## param name -> part reading upload value
+        self.sources = {}
+        self._text = []
+        for name, value in params.iteritems():
+            if is_upload(value):
+                filename = getattr(value, "name", None)
+                if not isinstance(filename, basestring):
+                    filename = name
+                filename = os.path.basename(filename)
+                self._text.append(
+                    "--%s\r\nContent-Disposition: form-data; name=\"%s\"; "
+                    "filename=\"%s\"\r\nContent-Type: %s\r\n\r\n" % (
+                    self.boundary, name, filename, content_type(filename)))
+                self._flush()
+                part = sources.get(name) if sources else None
+                if part is None:
+                    part = source_part(value)
+                self.sources[name] = part
+                self.parts.append(part)
+                self._text.append("\r\n")
+            else:
+                if isinstance(value, unicode):
+                    value = value.encode("utf-8")
+                self._text.append(
+                    "--%s\r\nContent-Disposition: form-data; name=\"%s\"\r\n\r\n"
+                    "%s\r\n" % (self.boundary, name, value))
+        self._text.append("--%s--\r\n" % self.boundary)
+        self._flush()
+
+        sizes = [part.size for part in self.parts]
+        ## None when some part has unknown size, body is sent chunked
+        self.size = None if None in sizes else sum(sizes)
+        self._index = 0
+
+    def _flush(self):
+        ## consecutive text fields are sent as one part, less read call
+        if self._text:
+            self.parts.append(BytesPart("".join(self._text)))
+            self._text = []
+
+    def header(self):
+        header = ["Content-Type: multipart/form-data; boundary=%s" % self.boundary,
+            ## don't wait for 100-continue the api never send
+            "Expect:"]
+        if self.size is None:
+            header.append("Transfer-Encoding: chunked")
+        return header
+
+    def read(self, size):
+        ## curl READFUNCTION, return "" when body is complete
+        while self._index < len(self.parts):
+            chunk = self.parts[self._index].read(size)
+            if chunk:
+                return chunk
+            self._index += 1
+        return ""
+
+    def can_replay(self):
+        """
+        Whether body can be sent again, False when a generator is already
+        consumed or a file can't be seeked back.
+        """
+        for part in self.sources.itervalues():
+            if not part.can_rewind():
+                return False
+        return True
+
+    def replay(self, params):
+        """
+        Return new body for params (e.g with refreshed access_token)
+        reading the same upload values from their start. None when it's not
+        possible.
+        """
+        for part in self.sources.itervalues():
+            if not part.rewind():
+                return None
+        return MultipartBody(params, self.sources)
+
+def source_part(value):
+    if isinstance(value, BUFFER_TYPES):
+        return BytesPart(value)
+    if hasattr(value, "read"):
+        return FilePart(value)
+    return IterPart(iter(value))
+
+def content_type(filename):
+    ## imported when needed, mimetypes read system mime database
+    import mimetypes
+    return mimetypes.guess_type(filename)[0] or "application/octet-stream"
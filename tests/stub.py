@@ -0,0 +1,69 @@
+"""
+Local stub api server for tests, every path is answered by a handler
+function set in server.routes, returning (code, body) or (code, body,
+header).
+
+## Example
+server = StubServer()
+server.routes["/v1/user/info"] = lambda params: (200, dict(result=params))
+MTOAuth.api_domain = server.url
+"""
+
+import BaseHTTPServer
+import SocketServer
+import json
+import threading
+import urlparse
+
+class StubHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        pass
+
+    def _handle(self):
+        server = self.server
+        url = urlparse.urlsplit(self.path)
+        length = int(self.headers.get("content-length") or 0)
+        if length:
+            self.rfile.read(length)
+        with server.lock:
+            server.hits += 1
+            server.connections.add(self.client_address)
+
+        route = server.routes.get(url.path)
+        if route is None:
+            rv = 404, dict(error="not found")
+        else:
+            params = dict(urlparse.parse_qsl(url.query))
+            params["header"] = self.headers
+            rv = route(params)
+        code, body = rv[:2]
+        header = dict(rv[2]) if len(rv) > 2 else {}
+        if not isinstance(body, str):
+            body = json.dumps(body)
+        header["Content-Type"] = "application/json"
+        header["Content-Length"] = len(body)
+        header = "".join("%s: %s\r\n" % item for item in header.iteritems())
+        ## single write, no wait for delayed ack
+        self.wfile.write("HTTP/1.1 %d X\r\n%s\r\n%s" % (code, header, body))
+
+    do_GET = _handle
+    do_POST = _handle
+
+class StubServer(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+
+    daemon_threads = True
+
+    def __init__(self):
+        BaseHTTPServer.HTTPServer.__init__(self, ("127.0.0.1", 0), StubHandler)
+        self.routes = {}
+        self.lock = threading.Lock()
+        self.hits = 0
+        ## client (host, port) seen, one per tcp connection
+        self.connections = set()
+        self.url = "http://127.0.0.1:%d" % self.server_address[1]
+        thread = threading.Thread(target=self.serve_forever)
+        thread.daemon = True
+        thread.start()
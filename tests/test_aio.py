@@ -0,0 +1,44 @@
+"""
+AsyncMTOAuth against a local stub api.
+
+## Run
+python -m unittest discover tests
+"""
+
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from pymtoauth.aio import AsyncMTOAuth
+from stub import StubServer
+
+class AsyncMTOAuthTest(unittest.TestCase):
+
+    def setUp(self):
+        self.server = StubServer()
+        self.mtoauth = AsyncMTOAuth("c", "s", "r", "k")
+        self.mtoauth.api_domain = self.server.url
+        self.mtoauth.auth_endpoint = self.server.url
+
+    def tearDown(self):
+        self.mtoauth.close()
+        self.server.shutdown()
+        self.server.server_close()
+
+    def test_exchange_code(self):
+        self.server.routes["/access_token"] = lambda params: (200,
+            "access_token=t-%s&refresh_token=r1" % params["code"])
+        future = self.mtoauth.exchange_code_with_access_token("x")
+        self.assertEqual(self.mtoauth.loop.run_until_complete(future),
+            (True, ("t-x", "r1")))
+
+    def test_blocking_only(self):
+        with self.assertRaises(TypeError):
+            self.mtoauth.stream_result("channel_stream", id=1)
+        with self.assertRaises(TypeError):
+            self.mtoauth.iter_channel_stream(id=1)
+
+if __name__ == "__main__":
+    unittest.main()
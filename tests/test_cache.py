@@ -0,0 +1,54 @@
+"""
+Cache backends.
+
+## Run
+python -m unittest discover tests
+"""
+
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from pymtoauth.cache import MemoryCache
+
+class MemoryCacheTest(unittest.TestCase):
+
+    def test_maxbytes(self):
+        cache = MemoryCache(maxsize=None, maxbytes=100)
+        for i in xrange(5):
+            cache.set(i, "x" * 30, 60)
+        ## oldest evicted first
+        self.assertEqual([cache.get(i) for i in xrange(5)],
+            [None, None, "x" * 30, "x" * 30, "x" * 30])
+        self.assertEqual(cache.bytes, 90)
+
+        ## replaced and deleted values are not counted anymore
+        cache.set(2, "y" * 10, 60)
+        cache.delete(3)
+        self.assertEqual(cache.bytes, 40)
+        ## never fits
+        cache.set(5, "z" * 101, 60)
+        self.assertEqual(cache.get(5), None)
+        self.assertEqual(cache.bytes, 40)
+
+    def test_maxsize_and_maxbytes(self):
+        cache = MemoryCache(maxsize=3, maxbytes=100)
+        for i in xrange(4):
+            cache.set(i, "x", 60)
+        self.assertEqual(len(cache), 3)
+        cache.get(1)
+        cache.set(4, "x" * 99, 60)
+        ## recently used 1 is kept
+        self.assertEqual(sorted(cache._data), [1, 4])
+        self.assertEqual(cache.bytes, 100)
+
+    def test_expired(self):
+        cache = MemoryCache()
+        cache.set("a", "x" * 10, -1)
+        self.assertEqual(cache.get("a"), None)
+        self.assertEqual(cache.bytes, 0)
+
+if __name__ == "__main__":
+    unittest.main()
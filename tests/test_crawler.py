@@ -0,0 +1,153 @@
+"""
+Crawler against a local stub api serving a small graph.
+
+## Run
+python -m unittest discover tests
+"""
+
+import BaseHTTPServer
+import SocketServer
+import json
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import unittest
+import urlparse
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from pymtoauth import MTOAuth
+from pymtoauth.crawler import Crawler, crawl_sharded
+from pymtoauth.retry import RetryPolicy
+
+USERS = 30
+
+def users(ids):
+    return [dict(id=i % USERS) for i in ids]
+
+## path -> fn(id) returning result items
+GRAPH = {
+    "/v1/user/supporters": lambda id: users([id * 2, id * 3 + 1]),
+    "/v1/user/supporting": lambda id: users([id + 1]),
+    "/v1/user/channels": lambda id: [dict(id=id % 4)],
+    "/v1/channel/members": lambda id: users(range(id * 5, id * 5 + 7)),
+    "/v1/channel/stream": lambda id: [dict(id=id * 100 + i) for i in xrange(2)],
+}
+
+class GraphHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        url = urlparse.urlsplit(self.path)
+        params = dict(urlparse.parse_qsl(url.query))
+        if self.server.down:
+            code, body = 503, json.dumps(dict(error="unavailable"))
+        else:
+            offset = int(params.get("offset", 0))
+            items = GRAPH[url.path](int(params.get("id") or params["user_id"]))
+            code, body = 200, json.dumps(dict(result=items[offset:]))
+        ## single write, no wait for delayed ack
+        self.wfile.write("HTTP/1.1 %d X\r\nContent-Type: application/json\r\n"
+            "Content-Length: %d\r\n\r\n%s" % (code, len(body), body))
+
+class GraphServer(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+
+    daemon_threads = True
+    down = False
+
+class CrawlerTest(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.server = GraphServer(("127.0.0.1", 0), GraphHandler)
+        thread = threading.Thread(target=cls.server.serve_forever)
+        thread.daemon = True
+        thread.start()
+        cls.url = "http://127.0.0.1:%d" % cls.server.server_address[1]
+        ## shard processes are forked, they see it too
+        cls.api_domain = MTOAuth.api_domain
+        MTOAuth.api_domain = cls.url
+
+    @classmethod
+    def tearDownClass(cls):
+        MTOAuth.api_domain = cls.api_domain
+        cls.server.shutdown()
+
+    def setUp(self):
+        self.server.down = False
+        self.dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def path(self, name):
+        return os.path.join(self.dir, name)
+
+    def client(self):
+        return MTOAuth("c", "s", "r", "k", retry_policy=RetryPolicy(max_retries=0))
+
+    def lines(self, *paths):
+        rv = []
+        for path in paths:
+            with open(path) as f:
+                rv.extend(json.dumps(json.loads(line), sort_keys=True) for line in f)
+        return rv
+
+    def crawl(self, output, checkpoint=None, seeds=[("user", 1)]):
+        crawler = Crawler(self.client(), output, checkpoint, concurrency=4)
+        return crawler.run(seeds)
+
+    def test_crawl(self):
+        stats = self.crawl(self.path("full.jsonl"))
+        ## every user and channel reachable from user 1
+        self.assertEqual(stats["crawled"], USERS + 4)
+        lines = self.lines(self.path("full.jsonl"))
+        self.assertEqual(len(lines), stats["records"])
+        self.assertEqual(len(lines), USERS * 4 + 4 * 9)
+
+    def test_resume(self):
+        self.crawl(self.path("full.jsonl"))
+        expected = self.lines(self.path("full.jsonl"))
+
+        output, checkpoint = self.path("out.jsonl"), self.path("out.checkpoint")
+        self.server.down = True
+        stats = self.crawl(output, checkpoint)
+        self.assertEqual((stats["crawled"], stats["errors"]), (0, 1))
+        ## lines written after the last checkpoint (crash before next one),
+        ## then resumed while api is still down
+        with open(output, "ab") as f:
+            f.write('{"partial": ')
+        self.crawl(output, checkpoint, seeds=[])
+
+        self.server.down = False
+        stats = self.crawl(output, checkpoint)
+        with open(output) as f:
+            self.assertEqual(f.read().count("\0"), 0)
+        self.assertEqual(sorted(self.lines(output)), sorted(expected))
+        self.assertEqual(stats["records"], len(expected))
+
+        ## nothing left to crawl
+        self.crawl(output, checkpoint)
+        self.assertEqual(sorted(self.lines(output)), sorted(expected))
+
+    def test_sharded(self):
+        self.crawl(self.path("full.jsonl"))
+        expected = self.lines(self.path("full.jsonl"))
+
+        client = dict(client_id="c", client_secret="s", redirect_uri="r",
+            api_key="k")
+        for checkpoint in (None, self.path("shard-{shard}.checkpoint")):
+            output = self.path("shard-%s-{shard}.jsonl" % bool(checkpoint))
+            stats = crawl_sharded([("user", 1)], 3, output, checkpoint, client)
+            lines = self.lines(*[output.format(shard=i) for i in xrange(3)])
+            self.assertEqual(sorted(lines), sorted(expected))
+            self.assertEqual(stats["records"], len(expected))
+
+if __name__ == "__main__":
+    unittest.main()
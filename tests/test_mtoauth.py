@@ -0,0 +1,182 @@
+"""
+MTOAuth against a local stub api.
+
+## Run
+python -m unittest discover tests
+"""
+
+import os
+import sys
+import threading
+import time
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from pymtoauth import MTOAuth
+from pymtoauth.mtoauth import MTApiException
+from pymtoauth.cache import ResponseCache, ConditionalCache
+from pymtoauth.retry import RetryPolicy
+from stub import StubServer
+
+def pages(total, error_offset=None):
+    ## paged route answering `total` items, 503 at error_offset
+    def route(params):
+        offset, limit = int(params["offset"]), int(params["limit"])
+        if offset == error_offset:
+            return 503, dict(error="unavailable")
+        return 200, dict(result=range(offset, min(total, offset + limit)))
+    return route
+
+class MTOAuthTest(unittest.TestCase):
+
+    def setUp(self):
+        self.server = StubServer()
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def client(self, **kwargs):
+        mtoauth = MTOAuth("c", "s", "r", "k", **kwargs)
+        mtoauth.api_domain = self.server.url
+        return mtoauth
+
+    def run_threads(self, func, count):
+        threads = [threading.Thread(target=func) for i in xrange(count)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join(10)
+            self.assertFalse(thread.is_alive())
+
+    def test_coalesced_last_request(self):
+        def slow(params):
+            time.sleep(0.2)
+            return 200, dict(result=[params["id"]])
+        self.server.routes["/v1/user/supporters"] = slow
+        mtoauth = self.client()
+        statuses = []
+
+        def call():
+            mtoauth.user_supporters(id=1)
+            statuses.append(mtoauth.last_request.response.status_code)
+
+        self.run_threads(call, 10)
+        self.assertEqual(self.server.hits, 1)
+        self.assertEqual(statuses, [200] * 10)
+
+    def test_iter_error_page(self):
+        self.server.routes["/v1/channel/stream"] = pages(50, error_offset=20)
+        mtoauth = self.client(retry_policy=RetryPolicy(max_retries=0))
+        for prefetch in (False, True):
+            items = []
+            with self.assertRaises(MTApiException):
+                for item in mtoauth.iter_channel_stream(id=1, prefetch=prefetch):
+                    items.append(item)
+            self.assertEqual(items, range(20))
+
+    def test_iter_cached_pages(self):
+        self.server.routes["/v1/user/supporters"] = pages(50)
+        mtoauth = self.client(cache=ResponseCache())
+        self.assertEqual(list(mtoauth.iter_user_supporters(id=1)), range(50))
+        hits = self.server.hits
+        ## pages fetched from cache in prefetch threads without last_request
+        self.assertEqual(list(mtoauth.iter_user_supporters(id=1, prefetch=True)),
+            range(50))
+        self.assertEqual(self.server.hits, hits)
+
+    def test_iter_coalesced(self):
+        def slow(params):
+            time.sleep(0.1)
+            return pages(30)(params)
+        self.server.routes["/v1/user/supporters"] = slow
+        mtoauth = self.client()
+        results = []
+
+        def call():
+            results.append(list(mtoauth.iter_user_supporters(id=1)))
+
+        self.run_threads(call, 10)
+        self.assertEqual(results, [range(30)] * 10)
+
+    def test_concurrent_batch(self):
+        self.server.routes["/v1/user/info"] = lambda params: (200,
+            dict(result=params["name"]))
+        mtoauth = self.client(pool_size=4, coalesce=False)
+        results = []
+
+        def call():
+            calls = [("user_info", dict(name=str(i))) for i in xrange(8)]
+            results.append(mtoauth.batch(calls))
+
+        self.run_threads(call, 4)
+        expected = [(None, str(i)) for i in xrange(8)]
+        self.assertEqual(results, [expected] * 4)
+
+    def test_batch_connection_reuse(self):
+        self.server.routes["/v1/user/info"] = lambda params: (200,
+            dict(result=params["name"]))
+        mtoauth = self.client()
+        for i in xrange(3):
+            mtoauth.batch([("user_info", dict(name=str(j))) for j in xrange(5)])
+        self.assertEqual(self.server.hits, 15)
+        self.assertTrue(len(self.server.connections) <= 5)
+
+    def test_stream_result_refresh(self):
+        token = dict(current="t2", refreshes=0)
+
+        def stream(params):
+            if params["access_token"] != token["current"]:
+                return 401, dict(error="expired")
+            return 200, dict(result=range(100))
+
+        def refresh(params):
+            token["refreshes"] += 1
+            return 200, "access_token=t2&refresh_token=r2"
+
+        self.server.routes["/v1/my/stream"] = stream
+        self.server.routes["/access_token"] = refresh
+        mtoauth = self.client()
+        mtoauth.auth_endpoint = self.server.url
+        mtoauth.set_token("t1", "r1")
+        self.assertEqual(list(mtoauth.stream_result("my_stream")), range(100))
+        self.assertEqual(token["refreshes"], 1)
+        self.assertEqual(mtoauth.last_request.response.status_code, 200)
+
+    def test_stream_result_retry(self):
+        failures = [503, 503]
+
+        def stream(params):
+            if failures:
+                return failures.pop(), dict(error="unavailable")
+            return 200, dict(result=range(100))
+
+        self.server.routes["/v1/channel/stream"] = stream
+        mtoauth = self.client(retry_policy=RetryPolicy(max_retries=2, backoff=0))
+        self.assertEqual(list(mtoauth.stream_result("channel_stream", id=1)),
+            range(100))
+        self.assertEqual(self.server.hits, 3)
+
+    def test_conditional_response_cache(self):
+        def stream(params):
+            if params["header"].get("if-none-match") == '"v1"':
+                return 304, "", {"ETag": '"v1"'}
+            return 200, dict(result=[1, 2]), {"ETag": '"v1"'}
+
+        self.server.routes["/v1/channel/stream"] = stream
+        cache, conditional = ResponseCache(), ConditionalCache()
+        mtoauth = self.client(cache=cache, conditional_cache=conditional)
+        self.assertEqual(mtoauth.channel_stream(id=1), [1, 2])
+        entry = conditional.get("/channel/stream", mtoauth.last_request.params)
+        self.assertEqual(sorted(entry), ["etag", "last_modified", "result"])
+
+        cache.clear()
+        self.assertEqual(mtoauth.channel_stream(id=1), [1, 2])
+        self.assertEqual(mtoauth.last_request.response.status_code, 304)
+        ## stored in response cache from the revalidated result
+        self.assertEqual(mtoauth.channel_stream(id=1), [1, 2])
+        self.assertEqual(self.server.hits, 2)
+
+if __name__ == "__main__":
+    unittest.main()
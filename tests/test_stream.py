@@ -0,0 +1,71 @@
+"""
+ResultStreamParser fed with documents split in small chunks.
+
+## Run
+python -m unittest discover tests
+"""
+
+import json
+import os
+import sys
+import time
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from pymtoauth.stream import ResultStreamParser
+
+class ResultStreamParserTest(unittest.TestCase):
+
+    def parse(self, body, size):
+        parser = ResultStreamParser()
+        items = []
+        for i in xrange(0, len(body), size):
+            parser.feed(body[i:i + size])
+            items.extend(parser.items)
+            parser.items.clear()
+        return items, parser.close()
+
+    def assertItems(self, body, expected):
+        for size in (1, 2, 3, len(body)):
+            self.assertEqual(self.parse(body, size), (expected, None))
+
+    def test_strings(self):
+        items = ["a]b", 'say "hi"', "[", "{", "\\", '\\"]', u"caf\xe9", ""]
+        self.assertItems(json.dumps(dict(result=items)), items)
+        ## escaped quote right before chunk boundary
+        self.assertItems('{"result": ["x\\"", "\\\\", "\\u0041"]}',
+            ['x"', "\\", "A"])
+
+    def test_nested_result(self):
+        body = ('{"meta": {"result": [1, 2]}, "other": ["result"], '
+            '"result": [{"result": [3]}, [{"a": "]"}], {}, []]}')
+        self.assertItems(body, [dict(result=[3]), [dict(a="]")], {}, []])
+
+    def test_split_scalars(self):
+        body = '{"result": [12345, -3.25e+10, true, false, null, 7 ,8]}'
+        self.assertItems(body, [12345, -3.25e+10, True, False, None, 7, 8])
+        self.assertItems('{"result":[]}', [])
+
+    def test_no_result_array(self):
+        for doc in (dict(result=dict(id=1, tags=["]"])), dict(result="x"),
+                dict(error="expired", detail='"result": ['), dict(ok=1)):
+            body = json.dumps(doc)
+            for size in (1, 2, 3):
+                self.assertEqual(self.parse(body, size), ([], doc))
+
+    def test_big_item_linear(self):
+        item = ["x" * 100] * 20000
+        body = json.dumps(dict(result=[item, 1]))
+        started = time.time()
+        self.assertEqual(self.parse(body, 4096)[0], [item, 1])
+        ## rescanning the unfinished item (or string) on every chunk took seconds
+        self.assertTrue(time.time() - started < 1.0)
+
+        body = json.dumps(dict(error="x" * len(body)))
+        started = time.time()
+        self.assertEqual(self.parse(body, 16384)[1], json.loads(body))
+        self.assertTrue(time.time() - started < 1.0)
+
+if __name__ == "__main__":
+    unittest.main()